@@ -0,0 +1,61 @@
+import numpy as np
+
+from base_policy import Policy
+from shortest import hop_distance
+
+
+class BackPressure(Policy):
+    """ BackPressure agent sends on each free link the packets of the destination
+    with the largest queue differential, the backlog of it here minus that at the other end of the link.
+
+    It runs the Network in 'bp' mode: `choose(source, links)` returns one destination per link,
+    from the backlogs the network keeps in `queue_count`.
+
+    Parameters:
+        bias (float): the weight of the hop-count differential added to the queue differential,
+            which steers packets along shortest paths at low load; 0 for the original algorithm.
+
+    Attributes:
+        network (Network): the network it routes,
+            whose `queue_count[x, d]` is the number of packets to `d` queued in `x`.
+        hops (np.array((nodes, nodes))): the hop counts between nodes, if `bias` is used.
+    """
+    mode = 'bp'
+
+    def __init__(self, network, bias=1.0):
+        super().__init__(network)
+        self.bias = bias
+        self.network = network
+        self.hops = hop_distance(self.links) if bias else None
+
+    def __repr__(self):
+        return f"<BackPressure bias:{self.bias}>"
+
+    def choose(self, source, links):
+        """ the destination whose packet to send on each of `links`, None to send nothing
+
+        Args:
+            source (int): the sending node.
+            links (List[int]): the neighbors with a free connection.
+
+        Returns:
+            List[int | None]
+        """
+        queue_count = self.network.queue_count
+        count = queue_count[source].copy()
+        # weight[l, d]: the differential of destination d over link l, for all links at once
+        weight = count - queue_count[links]
+        if self.bias:
+            weight = weight + self.bias * (self.hops[source] - self.hops[links])
+        sent = np.zeros_like(count)
+        dests = []
+        for w in weight:
+            # the packets assigned to the links before leave this node
+            w = np.where(count > sent, w - sent, -np.inf)
+            d = w.argmax()
+            if w[d] > 0:
+                sent[d] += 1
+                dests.append(int(d))
+            else:
+                dests.append(None)
+        return dests
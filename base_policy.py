@@ -1,5 +1,10 @@
+import os
 import numpy as np
 import pickle
+from collections import defaultdict
+
+from table import Table
+from checkpoint import write_checkpoint, read_checkpoint
 
 
 class Policy:
@@ -8,28 +13,52 @@ class Policy:
 
     Attributes:
         mode (string | None): identifier of what mode the policy needs Network running in.
-        attrs (Set[string]): the attributes would be dumpped/loaded in `self.store`/`self.load`.
+        attrs (Set[string]): the attributes would be dumpped/loaded in `self.store`/`self.load`
+            (and `self.store_checkpoint`).
         links (Dict[Int, np.array(Int)]): the network graph, the connections.
         action_idx (Dict[Int, Dict[Int, Int]]): store the indexes of node's neighbors in `links`
+        rng (np.random.Generator): the random stream of the agent, spawned by the network.
     """
     mode = None
     attrs = set(['links'])
 
     def __init__(self, network):
-        self.links = {k: np.array(v, dtype=np.int)
+        self.rng = network.spawn_rng()
+        self.links = {k: np.array(v, dtype=int)
                       for k, v in network.links.items()}
         self.action_idx = {node:
                            {a: i for i, a in enumerate(neighbors)}
                            for node, neighbors in self.links.items()}
 
+    def __getstate__(self):
+        " the attributes to pickle or copy, without the methods a PhaseProfiler wrapped (see `PhaseProfiler._install`) "
+        return {k: v for k, v in self.__dict__.items() if not hasattr(v, '__wrapped__')}
+
     def choose(self, source, dest):
         " choose decides which path would the `source` agent choose to `dest` "
         pass
 
+    def choose_many(self, source, dests):
+        " the actions `choose` would take at `source` for each of `dests` "
+        return [self.choose(source, dest) for dest in dests]
+
     def get_info(self, source, dest, action):
         " necessary information for training "
         return {}
 
+    def get_info_batch(self, rewards):
+        """ `get_info` of all `rewards` (a RewardBatch), column by column.
+        Called after all nodes sent in a step; by default reward by reward.
+
+        Returns:
+            Dict[str, List | np.array]
+        """
+        info = defaultdict(list)
+        for source, action, packet in zip(rewards.source, rewards.action, rewards.packets):
+            for k, v in self.get_info(source, action, packet).items():
+                info[k].append(v)
+        return info
+
     def learn(self, rewards, lr={}):
         " learn and update tables from rewards given "
         pass
@@ -54,13 +83,61 @@ class Policy:
         " [optional] penalty when a packet is dropped "
         pass
 
-    def store(self, filename):
-        " dump `attrs` by pickle "
+    def memory(self):
+        " the bytes of the tables and arrays of the agent, by attribute "
+        return {k: v.nbytes for k, v in self.__dict__.items() if hasattr(v, 'nbytes') and not isinstance(v, type)}
+
+    def _refresh(self):
+        " [optional] rebuild what is derived from `attrs`, called after `load` "
+        pass
+
+    def _state(self, dtype=None):
+        " `attrs` to store, the tables converted to `dtype` if given "
+        state = {k: self.__dict__[k] for k in self.attrs}
+        if dtype is not None:
+            state = {k: v.astype(dtype) if isinstance(v, Table) else v for k, v in state.items()}
+        return state
+
+    def store(self, filename, dtype=None):
+        """ dump `attrs` by pickle
+
+        Args:
+            dtype: [optional] the type to store tables in, e.g. np.float16 for a snapshot
+                to route with rather than to train further.
+        """
         with open(filename, 'wb') as f:
-            pickle.dump({k: self.__dict__[k] for k in self.attrs}, f)
+            pickle.dump(self._state(dtype), f)
+
+    def store_checkpoint(self, directory, dtype=None):
+        """ dump `attrs` to a checkpoint directory, each table in a file `load` can memory-map (see `write_checkpoint`).
+        Storing to the directory of an earlier checkpoint only writes the tables changed since.
+
+        Args:
+            dtype: [optional] as `store`.
+
+        Returns:
+            List[str]: the array files written.
+        """
+        return write_checkpoint(directory, self._state(dtype))
+
+    def load(self, filename, mmap_mode=None):
+        """ load `attrs` by pickle, or from a checkpoint directory of `store_checkpoint`
 
-    def load(self, filename):
-        " load `attrs` by pickle "
-        with open(filename, 'rb') as f:
-            for k, v in pickle.load(f).items():
-                self.__dict__[k] = v
+        Args:
+            mmap_mode: [optional] for a checkpoint, None reads the tables into memory,
+                'r' maps them read-only (to route, not to learn) and 'c' copy-on-write.
+                A SparseTable routing to rows not stored copies its rows to memory to add them.
+        """
+        if os.path.isdir(filename):
+            state = read_checkpoint(filename, mmap_mode)
+        elif mmap_mode is not None:
+            raise ValueError(f"{filename} is a pickle, only checkpoints are memory-mapped")
+        else:
+            with open(filename, 'rb') as f:
+                state = pickle.load(f)
+        for k, v in state.items():
+            if isinstance(v, dict) and isinstance(self.__dict__.get(k), Table):
+                # tables dumpped as `{node: np.array}` dictionaries
+                v = Table.from_dict(self.links, v)
+            self.__dict__[k] = v
+        self._refresh()
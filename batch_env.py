@@ -0,0 +1,221 @@
+import numpy as np
+from collections import OrderedDict
+
+from env import Network
+from table import Table
+from qroute import _rounds
+
+# states of packet slots
+FREE, QUEUED, FLYING = 0, 1, 2
+
+
+class BatchNetwork:
+    """ BatchNetwork runs `replicas` independent copies of a network routed by Qroute in lockstep,
+    keeping the queues, link occupancy and Q-tables of all of them in arrays with a leading replica axis,
+    so one step of all replicas is a few NumPy operations.
+
+    A replica follows the rules of `Network` in default mode with a `Qroute` agent:
+    each node sends the first packet in its queue whose greedy next hop has free bandwidth,
+    and the agent learns from the rewards of the step one by one.
+    Events arriving at the same time are received in the order they were sent,
+    and packets are never dropped.
+
+    Args:
+        file (string): The name of network file.
+        replicas (int): the number of copies.
+        bandwidth, transtime: as `Network`.
+        initQ, discount: as `Qroute`.
+        seed (int | np.random.SeedSequence): [optional] the seed of all replicas, drawn from `np.random` if not given.
+
+    Attributes:
+        Qtable (np.array((replicas, entries))): the flat buffers of the Q-tables (see `Table`).
+        sent (np.array(Int, (replicas, links))): the packets under delivery on each directed link.
+        clock (float): The simulation time.
+        all_packets, end_packets, hops (np.array(Int, (replicas,))): as `Network`, per replica.
+        route_time (np.array((replicas,))): the total routing time of all ended packets, per replica.
+    """
+    # packet slots: the fields of packets of all replicas, indexed by slot
+    _fields = [('_state', np.int64), ('_replica', np.int64), ('_node', np.int64), ('_dest', np.int64),
+               ('_link', np.int64), ('_order', np.int64), ('_hops', np.int64),
+               ('_birth', np.float64), ('_start_queue', np.float64), ('_arrive', np.float64)]
+
+    def __init__(self, file, replicas, bandwidth=1, transtime=1, initQ=0, discount=0.99, seed=None):
+        network = Network(file, seed=seed)
+        self.replicas = replicas
+        self.bandwidth = bandwidth
+        self.transtime = transtime
+        self.discount = discount
+        self.links = OrderedDict((x, np.array(y, dtype=int)) for x, y in network.links.items())
+        self.rng = network.spawn_rng()
+        n = len(self.links)
+        self._table = Table(self.links)
+        self._link_to = np.concatenate([self.links[x] for x in range(n)])
+        self._link_start = np.zeros(n + 1, dtype=int)
+        np.cumsum(self._table.degree, out=self._link_start[1:])
+
+        # the initialization rule of Qroute, applied to every replica
+        rule = self._table.like(np.nan)
+        for x, table in rule.items():
+            table[x] = 0
+            table[self.links[x]] = -np.eye(table.shape[1])
+        self.Qtable = self.rng.normal(initQ, 1, (replicas, rule.data.size))
+        fixed = ~np.isnan(rule.data)
+        self.Qtable[:, fixed] = rule.data[fixed]
+        self._best = np.zeros((replicas, n, n), dtype=int)
+        self._best_Q = np.zeros((replicas, n, n))
+        r, x, d = np.unravel_index(np.arange(replicas * n * n), (replicas, n, n))
+        self._touch(r, x, d)
+        self.reset()
+
+    def __repr__(self):
+        return f"BatchNetwork<{self.replicas} replicas of {len(self.links)} nodes, {self.active_packets.sum()} packets>"
+
+    def reset(self):
+        """ reset the networks, NOT the Q-tables """
+        self.clock = 0
+        self.sent = np.zeros((self.replicas, len(self._link_to)), dtype=int)
+        self.all_packets = np.zeros(self.replicas, dtype=int)
+        self.end_packets = np.zeros(self.replicas, dtype=int)
+        self.hops = np.zeros(self.replicas, dtype=int)
+        self.route_time = np.zeros(self.replicas)
+        self._counter = 0  # stamps queue order and send order
+        for name, _ in self._fields:
+            self.__dict__.pop(name, None)
+        self._allocate(1024)
+
+    def _allocate(self, capacity):
+        " grow the packet slots to `capacity`, keeping the packets "
+        for name, dtype in self._fields:
+            array = np.zeros(capacity, dtype=dtype)
+            old = self.__dict__.get(name)
+            if old is not None:
+                array[:len(old)] = old
+            self.__dict__[name] = array
+
+    @property
+    def active_packets(self):
+        return self.all_packets - self.end_packets
+
+    @property
+    def ave_route_time(self):
+        return np.where(self.end_packets > 0, self.route_time / np.maximum(self.end_packets, 1), 0)
+
+    @property
+    def ave_hops(self):
+        return np.where(self.end_packets > 0, self.hops / np.maximum(self.end_packets, 1), 0)
+
+    def _touch(self, r, x, d):
+        " update the greedy cache of rows Qtable[r[i]] of (x[i], d[i]) for all i "
+        degree = self._table.degree[x]
+        columns = np.arange(degree.max() if len(x) else 0)
+        valid = columns < degree[:, None]
+        index = np.where(valid, (self._table.offsets[x] + d * degree)[:, None] + columns, 0)
+        values = np.where(valid, self.Qtable[r[:, None], index], -np.inf)
+        best = values.argmax(axis=1)
+        self._best[r, x, d] = best
+        self._best_Q[r, x, d] = values[np.arange(len(x)), best]
+
+    def inject(self, lambd):
+        """ Injects Poisson(lambd) new packets into each replica, between uniformly random pairs of nodes """
+        n = len(self.links)
+        counts = self.rng.poisson(lambd, self.replicas)
+        total = counts.sum()
+        free = np.flatnonzero(self._state == FREE)
+        if len(free) < total:
+            self._allocate(max(2 * len(self._state), len(self._state) + total))
+            free = np.flatnonzero(self._state == FREE)
+        slots = free[:total]
+        sources = self.rng.integers(0, n, total)
+        self._state[slots] = QUEUED
+        self._replica[slots] = np.repeat(np.arange(self.replicas), counts)
+        self._node[slots] = sources
+        self._dest[slots] = (sources + self.rng.integers(1, n, total)) % n
+        self._birth[slots] = self._start_queue[slots] = self.clock
+        self._hops[slots] = 0
+        self._order[slots] = self._counter + np.arange(total)
+        self._counter += total
+        self.all_packets += counts
+
+    def step(self, duration):
+        """ step runs all replicas forward `duration`
+
+        Returns:
+            Dict[str, np.array]: the rewards of packets sent in this step, column by column:
+                replica, source, action_idx (the index of the next hop in `links[source]`), dest,
+                r (the reward) and max_Q_y, ordered by replica and source.
+        """
+        n = len(self.links)
+        # every node sends the first queued packet whose next hop is avaliable
+        queued = np.flatnonzero(self._state == QUEUED)
+        replica, node, dest = self._replica[queued], self._node[queued], self._dest[queued]
+        action_idx = self._best[replica, node, dest]
+        link = self._link_start[node] + action_idx
+        ok = self.sent[replica, link] < self.bandwidth
+        queued, key, action_idx, link = queued[ok], (replica * n + node)[ok], action_idx[ok], link[ok]
+        order = np.lexsort((self._order[queued], key))
+        first = order[np.r_[True, key[order][1:] != key[order][:-1]]] if len(order) else order
+        p, link = queued[first], link[first]
+        replica, source, dest, action = self._replica[p], self._node[p], self._dest[p], self._link_to[link]
+        rewards = {
+            'replica': replica, 'source': source, 'action_idx': action_idx[first], 'dest': dest,
+            'r': -(self.clock - self._start_queue[p]) - 1,
+            'max_Q_y': self._best_Q[replica, action, dest],
+        }
+        self._state[p] = FLYING
+        self._hops[p] += 1
+        self.sent[replica, link] += 1
+        self._node[p], self._link[p] = action, link
+        self._arrive[p] = self.clock + self.transtime
+        self._order[p] = self._counter + np.arange(len(p))  # the send order
+        self._counter += len(p)
+
+        # deliver the packets arriving in this step, in time order
+        end_time = self.clock + duration
+        flying = np.flatnonzero((self._state == FLYING) & (self._arrive <= end_time))
+        flying = flying[np.lexsort((self._order[flying], self._arrive[flying]))]
+        replica = self._replica[flying]
+        np.subtract.at(self.sent, (replica, self._link[flying]), 1)
+        ended = self._node[flying] == self._dest[flying]
+        e, r = flying[ended], replica[ended]
+        self.end_packets += np.bincount(r, minlength=self.replicas)
+        self.route_time += np.bincount(r, self._arrive[e] - self._birth[e], minlength=self.replicas)
+        self.hops += np.bincount(r, self._hops[e], minlength=self.replicas).astype(int)
+        self._state[e] = FREE
+        q = flying[~ended]
+        self._state[q] = QUEUED
+        self._start_queue[q] = self._arrive[q]
+        self._order[q] = self._counter + np.arange(len(q))
+        self._counter += len(q)
+
+        self.clock = end_time
+        return rewards
+
+    def learn(self, rewards, lr={'q': 0.1}):
+        """ Qroute's update from `rewards` of `step`, in order within each replica """
+        replica, x, y_idx, d = rewards['replica'], rewards['source'], rewards['action_idx'], rewards['dest']
+        index = replica * self.Qtable.shape[1] + self._table.index(x, d, y_idx)
+        Q = self.Qtable.reshape(-1)
+        target = rewards['r'] + self.discount * rewards['max_Q_y']
+        for at in _rounds(replica * len(self.links) + x, d, y_idx):
+            Q[index[at]] += lr['q'] * (target[at] - Q[index[at]])
+        self._touch(replica, x, d)
+
+    def train(self, duration, lambd, slot=1, freq=1, lr={}, hop=False):
+        """ train runs all replicas as `Network.train` does
+
+        Returns:
+            Result (Dict[Str, np.array((replicas, steps))]): route_time (and hop) of each replica.
+        """
+        lr = lr if lr else self.learn.__defaults__[0]
+        step_num = int(duration / slot)
+        result = {'route_time': np.zeros((self.replicas, step_num))}
+        if hop:
+            result['hop'] = np.zeros((self.replicas, step_num))
+        for i in range(step_num):
+            self.inject(lambd * slot)
+            for _ in range(freq):
+                self.learn(self.step(slot), lr)
+            result['route_time'][:, i] = self.ave_route_time
+            if hop:
+                result['hop'][:, i] = self.ave_hops
+        return result
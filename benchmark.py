@@ -0,0 +1,982 @@
+""" Micro-benchmarks of the simulator hot paths.
+
+Usage:
+    python benchmark.py [name ...]
+
+where `name` is one of the keys of `BENCHMARKS` (all of them by default).
+"""
+import os
+import copy
+import sys
+import pickle
+import time
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import tracemalloc
+import numpy as np
+from heapq import heappush, heappop, nsmallest
+
+from env import Packet, Event, Reward, RewardBatch, EventQueue, DestQueue, Network
+from base_policy import Policy
+from qroute import Qroute, CQ, CDRQ, DRQ
+from shortest import Shortest, GlobalRoute
+from backpressure import BackPressure
+from sweep import sweep
+from batch_env import BatchNetwork
+from parallel import ParallelNetwork
+from traffic import UniformTraffic, HotspotTraffic, GravityTraffic, TraceRecorder, TraceTraffic
+from hybrid import PolicyGradient, HybridQ, HybridCQ, HybridCDRQ
+from multi_agent import MaHybridQ
+from frozen import FrozenPolicy
+
+
+def _timeit(func, repeat=3):
+    " the best wall time of `repeat` runs "
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def synthetic_network(nodes, degree=3, seed=0):
+    """ Writes a random connected network of `nodes` nodes and about `degree` links per node
+    in the format of `Network.read_network`.
+
+    Returns:
+        str: the name of the file.
+    """
+    rng = np.random.RandomState(seed)
+    edges = {(i, rng.randint(i)) for i in range(1, nodes)}  # a random spanning tree
+    while len(edges) < nodes * degree // 2:
+        a, b = rng.randint(nodes, size=2)
+        if a != b and (b, a) not in edges:
+            edges.add((a, b))
+    fd, file = tempfile.mkstemp(suffix='.net')
+    with os.fdopen(fd, 'w') as f:
+        for i, (x, y) in enumerate(rng.random_sample((nodes, 2))):
+            f.write(f"1000 {i} {x:.6f} {y:.6f} 0\n")
+        for a, b in sorted(edges):
+            f.write(f"2000 {a} {b} 0\n")
+    return file
+
+
+def bench_event_queue(in_flight=(10, 100, 1000, 10000), events=2000):
+    """ events/sec of the steady-state push/drain cycle versus the number of in-flight Events,
+    comparing `EventQueue` with the former `nsmallest(1, heap)` peek.
+    """
+    def legacy(n):
+        heap = [Event(None, 0, 1, t % n) for t in range(n)]
+        heap.sort()
+
+        def run():
+            for t in range(n, n + events):
+                heappush(heap, Event(None, 0, 1, t))
+                next_event = nsmallest(1, heap)
+                while len(next_event) > 0 and next_event[0].arrive_time <= t - n:
+                    heappop(heap)
+                    next_event = nsmallest(1, heap)
+        return run
+
+    def scheduler(n):
+        queue = EventQueue()
+        for t in range(n):
+            queue.push(Event(None, 0, 1, t % n))
+
+        def run():
+            for t in range(n, n + events):
+                queue.push(Event(None, 0, 1, t))
+                for _ in queue.pop_until(t - n):
+                    pass
+        return run
+
+    print(f"{'in-flight':>10} {'nsmallest ev/s':>16} {'EventQueue ev/s':>16}")
+    for n in in_flight:
+        old, new = _timeit(legacy(n), 1), _timeit(scheduler(n), 1)
+        print(f"{n:>10} {events / old:>16.0f} {events / new:>16.0f}")
+
+
+def bench_dest_queue(lengths=(10, 100, 1000, 5000), nodes=116):
+    """ packets/sec of sending whole node queues by destination, as in 'bp' mode,
+    comparing a list scanned for the destination with `DestQueue`.
+    """
+    def legacy(packets):
+        def run():
+            queue = list(packets)
+            for dest in dests:
+                p = next(p for p in queue if p.dest == dest)
+                queue.remove(p)
+        return run
+
+    def indexed(packets):
+        def run():
+            queue = DestQueue(np.zeros(nodes, dtype=int))
+            for p in packets:
+                queue.append(p)
+            for dest in dests:
+                queue.pop(dest)
+        return run
+
+    print(f"{'queue':>10} {'list pkt/s':>12} {'DestQueue pkt/s':>16}")
+    for n in lengths:
+        packets = [Packet(0, d, 0) for d in np.random.randint(1, nodes, n)]
+        dests = [p.dest for p in packets]
+        np.random.shuffle(dests)
+        old, new = _timeit(legacy(packets), 1), _timeit(indexed(packets), 1)
+        print(f"{n:>10} {n / old:>12.0f} {n / new:>16.0f}")
+
+
+def bench_active_nodes(runs=((2000, 0.5), (2000, 5.0), (2000, 50.0)), duration=300):
+    """ steps/sec of `Network.step` letting only the active nodes send,
+    versus visiting every node, on synthetic networks under `Shortest` routing.
+    """
+    print(f"{'nodes':>8} {'load':>6} {'all nodes step/s':>17} {'active step/s':>14} {'active nodes':>13}")
+    for nodes, load in runs:
+        file = synthetic_network(nodes)
+        rates = []
+        for every in (True, False):
+            np.random.seed(0)
+            nw = Network(file)
+            nw.agent = Shortest(nw)
+            active = 0
+            start = time.perf_counter()
+            for _ in range(duration):
+                nw.inject(nw.new_packet(load))
+                if every:  # the idle ones leave the set as soon as they are visited
+                    nw.active.update(nw.nodes)
+                active += len(nw.active)
+                nw.agent.learn(nw.step(1))
+            rates.append(duration / (time.perf_counter() - start))
+        print(f"{nodes:>8} {load:>6} {rates[0]:>17.1f} {rates[1]:>14.1f} {active / duration:>13.1f}")
+        os.remove(file)
+
+
+class _DictPacket:
+    " the former `__dict__` Packet, Event and Reward, for comparison "
+    def __init__(self, source, dest, birth):
+        self.source = source
+        self.dest = dest
+        self.birth = birth
+        self.hops = 0
+        self.trans_time = 0
+
+
+class _DictEvent:
+    def __init__(self, packet, from_node, to_node, arrive_time):
+        self.packet = packet
+        self.from_node = from_node
+        self.to_node = to_node
+        self.arrive_time = arrive_time
+
+
+class _DictReward:
+    def __init__(self, source, packet, action, agent_info={}):
+        self.source = source
+        self.dest = packet.dest
+        self.action = action
+        self.packet = packet
+        self.agent_info = agent_info
+
+
+def bench_packets(n=100000, hops=4):
+    """ bytes per in-flight packet (with its Event and Reward) and packet hops/sec
+    of the slotted classes versus the former `__dict__` classes.
+    """
+    def lifetime(packet, event, reward):
+        def run():
+            packets = [packet(i, i + 1, 0) for i in range(n)]
+            for t in range(hops):
+                flight = []
+                for p in packets:
+                    p.start_queue = t
+                    p.hops += 1
+                    p.trans_time = 1
+                    flight.append((event(p, p.source, p.dest, t + 1),
+                                   reward(p.source, p, p.dest, {'q_y': t - p.start_queue, 't_y': 1})))
+            return packets, flight
+        return run
+
+    print(f"{'':>18} {'bytes/packet':>13} {'hops/s':>12}")
+    for name, run in [('__dict__ classes', lifetime(_DictPacket, _DictEvent, _DictReward)),
+                      ('__slots__ classes', lifetime(Packet, Event, Reward))]:
+        tracemalloc.start()
+        kept = run()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del kept
+        print(f"{name:>18} {size / n:>13.0f} {n * hops / _timeit(run):>12.0f}")
+
+
+def check_info_batch(file='6x6.net', load=3.0, steps=50):
+    """ compares the `get_info_batch` of each policy with its `get_info` reward by reward,
+    and `Reward`s read back from a RewardBatch with the ones it was built from.
+    """
+    for cls in [Qroute, CQ, CDRQ, DRQ, HybridQ, HybridCQ, HybridCDRQ, MaHybridQ]:
+        np.random.seed(0)
+        nw = Network(file)
+        nw.agent = cls(nw)
+        # tables as if learned, without the learning of the broken policies
+        nw.agent.Qtable.data[:] = np.random.normal(0, 1, nw.agent.Qtable.data.size)
+        if hasattr(nw.agent, 'confidence'):
+            nw.agent.confidence.data[:] = np.random.random_sample(nw.agent.confidence.data.size)
+        nw.agent._refresh()
+        for _ in range(steps):
+            nw.inject(nw.new_packet(load))
+            rewards = nw.step(1)
+            expected = Policy.get_info_batch(nw.agent, rewards)
+            info = nw.agent.get_info_batch(rewards)
+            assert set(info) == set(expected), cls
+            for k in info:
+                assert np.array_equal(info[k], expected[k]), (cls, k)
+            copy = RewardBatch.from_rewards(list(rewards))
+            for k in ['source', 'action', 'dest', 'packet_source'] + list(rewards.info):
+                assert np.array_equal(copy.column(k), rewards.column(k)), (cls, k)
+        print(f"{cls.__name__}: ok")
+
+
+def bench_traffic(file='lata.net', loads=(1.0, 10.0, 100.0), slots=2000):
+    """ packets/sec of drawing new packets: the former loop with rejection of dest == source,
+    `Traffic` slot by slot (`new_packet`) and `Traffic` for all slots at once (`train`).
+    """
+    nw = Network(file)
+
+    def legacy(lambd):
+        nodes_num = len(nw.nodes)
+        for _ in range(slots):
+            for _ in range(np.random.poisson(lambd)):
+                source, dest = np.random.randint(0, nodes_num, size=2)
+                while dest == source:
+                    dest = np.random.randint(0, nodes_num)
+                Packet(source, dest, 0)
+
+    def per_slot(traffic, lambd):
+        def run():
+            nw.traffic = traffic
+            for _ in range(slots):
+                nw.new_packet(lambd)
+        return run
+
+    def bulk(traffic, lambd):
+        def run():
+            nw.traffic = traffic
+            arrivals = nw._arrivals(lambd, 1, 1, chunk=slots)
+            for _ in range(slots):
+                nw._packets(*next(arrivals))
+        return run
+
+    traffics = [('uniform', UniformTraffic(nw)), ('hotspot', HotspotTraffic(nw, [0])), ('gravity', GravityTraffic(nw))]
+    print(f"{'load':>6} {'legacy pkt/s':>13}" + "".join(f" {f'{name} slot':>13} {f'{name} bulk':>13}" for name, _ in traffics))
+    for lambd in loads:
+        row = f"{lambd:>6} {lambd * slots / _timeit(lambda: legacy(lambd)):>13.0f}"
+        for _, traffic in traffics:
+            row += f" {lambd * slots / _timeit(per_slot(traffic, lambd)):>13.0f}" \
+                   f" {lambd * slots / _timeit(bulk(traffic, lambd)):>13.0f}"
+        print(row)
+
+
+def check_trace(file='lata.net', duration=1500, load=1.0):
+    """ a trace must hold the slots a run injected, and replaying it must inject them
+    whichever calls the run is split into """
+    nw = Network(file, seed=0)
+    nw.agent = Shortest(nw)
+    fd, trace = tempfile.mkstemp(suffix='.trace')
+    os.close(fd)
+    with TraceRecorder(nw.traffic, trace) as recorder:
+        nw.traffic = recorder
+        nw.train(duration, load)
+        nw.sample_route_time(50, load)
+    injected = nw.all_packets
+    replay = TraceTraffic(nw, trace)
+    assert len(replay.trace) == injected, (len(replay.trace), injected)
+    for splits in ([duration], [duration - 300, 300], [duration // 3] * 3):
+        nw = Network(file, seed=0)
+        nw.agent = Shortest(nw)
+        nw.traffic = TraceTraffic(nw, trace)
+        for part in splits:
+            nw.train(part, load)
+        nw.sample_route_time(50, load)
+        assert nw.all_packets == injected, (splits, nw.all_packets, injected)
+    # empty slots at the end are kept
+    with TraceRecorder(UniformTraffic(nw), trace) as recorder:
+        recorder.arrivals(0.0, np.arange(20))
+    assert len(TraceTraffic(nw, trace)) == 20
+    os.remove(trace)
+    print(f"ok, {injected} packets in {len(replay)} slots")
+
+
+def bench_trace_replay(file='lata.net', load=3.0, slots=20000):
+    """ packets/sec of drawing `UniformTraffic` versus replaying it from a trace file,
+    and the packets `Qroute` and `CQ` get from the same trace.
+    """
+    nw = Network(file)
+    fd, trace = tempfile.mkstemp(suffix='.trace')
+    os.close(fd)
+    with TraceRecorder(UniformTraffic(nw), trace) as recorder:
+        packets = sum(len(s) for s, _ in recorder.arrivals(load, np.arange(slots)))
+    replay = TraceTraffic(nw, trace)
+
+    def draw():
+        nw.traffic.arrivals(load, np.arange(slots))
+
+    def read():
+        replay.rewind()
+        replay.arrivals(load, np.arange(slots))
+
+    print(f"{packets} packets, {os.path.getsize(trace) / packets:.1f} bytes/packet on disk")
+    print(f"draw: {packets / _timeit(draw):.0f} packets/s, replay: {packets / _timeit(read):.0f} packets/s")
+    for cls in [Qroute, CQ]:
+        nw = Network(file)
+        nw.agent = cls(nw)
+        nw.traffic = TraceTraffic(nw, trace)
+        nw.train(slots // 10, load)
+        print(f"{cls.__name__} got {nw.all_packets} packets")
+    os.remove(trace)
+
+
+def _seeded_run(cls, seed, file='6x6.net', load=1.5, duration=300):
+    nw = Network(file, seed=seed)
+    nw.agent = cls(nw)
+    route_time = nw.train(duration, load)['route_time']
+    return route_time, nw.all_packets
+
+
+def check_rng_streams(seeds=range(4)):
+    """ checks that seeded runs reproduce in worker processes, and that the traffic of a seed
+    is the same whatever the policy draws from its own stream, and whichever policy took one.
+    """
+    serial = [_seeded_run(HybridQ, seed) for seed in seeds]
+    with ProcessPoolExecutor(2) as executor:
+        parallel = list(executor.map(_seeded_run, [HybridQ] * len(seeds), seeds))
+    for (a, n), (b, m) in zip(serial, parallel):
+        assert np.array_equal(a, b) and n == m, "a seeded run must not depend on the process"
+    for seed, (_, n) in zip(seeds, serial):
+        assert _seeded_run(Qroute, seed)[1] == n, "the traffic must not depend on the policy"
+    # building a policy takes one stream, so the components built after it get the same ones
+    for cls in (Shortest, GlobalRoute, BackPressure, Qroute, CQ):
+        nw, plain = Network('6x6.net', seed=0), Network('6x6.net', seed=0)
+        cls(nw), Policy(plain)
+        assert nw.spawn_rng().random() == plain.spawn_rng().random(), cls
+    print("ok")
+
+
+def bench_sweep(file='lata.net', loads=(0.5, 1.0, 1.5, 2.0), seeds=(0, 1), duration=300, workers=None):
+    " wall time of a load sweep in one process versus in a process pool, with the same results "
+    start = time.perf_counter()
+    serial = sweep(file, Qroute, loads, seeds, duration, workers=1)
+    middle = time.perf_counter()
+    parallel = sweep(file, Qroute, loads, seeds, duration, workers=workers or max(2, os.cpu_count() or 1))
+    end = time.perf_counter()
+    assert all(np.array_equal(serial[k], parallel[k]) for k in serial.keys)
+    print(f"{os.cpu_count()} CPUs, {len(loads) * len(seeds)} runs: "
+          f"serial {middle - start:.2f} s, pool {end - middle:.2f} s")
+    print("final route time:", " ".join(f"{load}: {t:.2f}" for load, t in zip(loads, parallel.final())))
+
+
+def bench_batch_env(runs=(('6x6.net', 1.0), ('lata.net', 1.0)), replicas=16, duration=300):
+    """ wall time of `replicas` Qroute runs in lockstep in a BatchNetwork versus one Network after another,
+    with the mean and standard error of the final route time of both """
+    for file, load in runs:
+        start = time.perf_counter()
+        batch = BatchNetwork(file, replicas, seed=0).train(duration, load)['route_time'][:, -1]
+        middle = time.perf_counter()
+        serial = np.array([_seeded_run(Qroute, seed, file, load, duration)[0][-1] for seed in range(replicas)])
+        end = time.perf_counter()
+        print(f"{file} load {load}, {replicas} replicas: batch {middle - start:.2f} s, serial {end - middle:.2f} s; "
+              f"route time {batch.mean():.2f}±{batch.std() / np.sqrt(replicas):.2f} "
+              f"vs {serial.mean():.2f}±{serial.std() / np.sqrt(replicas):.2f}")
+
+
+def check_parallel(runs=(('6x6.net', Qroute, 2.0, {}), ('lata.net', Qroute, 1.5, {}), ('6x6.net', CQ, 2.0, {}),
+                         ('lata.net', Shortest, 1.0, {}), ('6x6.net', Qroute, 2.0, {'is_drop': True, 'transtime': 2})),
+                   workers=3, duration=300):
+    " compares `ParallelNetwork` to `Network` with the same seed: the results and the learned tables must be equal "
+    for file, cls, load, kwargs in runs:
+        nw = Network(file, seed=3, **kwargs)
+        nw.agent = cls(nw)
+        serial = nw.train(duration, load, droprate=True, hop=True)
+        with ParallelNetwork(file, cls, workers, seed=3, **kwargs) as pnw:
+            parallel = pnw.train(duration, load, droprate=True, hop=True)
+            agent = pnw.gather_agent()
+        assert all(np.array_equal(serial[k], parallel[k]) for k in serial), (file, cls, kwargs)
+        assert not hasattr(agent, 'Qtable') or np.array_equal(agent.Qtable.data, nw.agent.Qtable.data)
+        print(f"{file} {cls.__name__} {kwargs}: same, route time {parallel['route_time'][-1]:.2f}")
+
+
+def bench_parallel(sizes=(300, 1000), workers=(2, 4), duration=100, load=5.0):
+    " steps/sec of Qroute training in `Network` versus `ParallelNetwork` on synthetic networks "
+    print(f"{os.cpu_count()} CPUs")
+    for n in sizes:
+        file = synthetic_network(n)
+        nw = Network(file, seed=0)
+        nw.agent = Qroute(nw)
+        start = time.perf_counter()
+        nw.train(duration, load)
+        rates = [f"serial {duration / (time.perf_counter() - start):.1f}"]
+        for w in workers:
+            with ParallelNetwork(file, Qroute, w, seed=0) as pnw:
+                start = time.perf_counter()
+                pnw.train(duration, load)
+                rates.append(f"{w} workers {duration / (time.perf_counter() - start):.1f}")
+        print(f"synthetic {n}: step/s " + ", ".join(rates))
+        os.remove(file)
+
+
+def check_sparse(runs=((Qroute, '6x6.net', 2.0, {}), (Qroute, 'lata.net', 1.5, {}), (CQ, '6x6.net', 2.0, {}),
+                       (CDRQ, '6x6.net', 2.0, {}), (HybridQ, 'lata.net', 1.0, {}),
+                       (MaHybridQ, '6x6.net', 1.0, {'q': 0.1, 'p': 0.001})), duration=300):
+    """ compares agents with sparse and dense tables, the sparse rows initialized to the values of the dense ones:
+    the route times must be equal. """
+    for cls, file, load, lr in runs:
+        results, memory = [], []
+        dense = cls(Network(file, seed=5)).Qtable
+        for sparse in (False, True):
+            nw = Network(file, seed=5)
+            agent = cls(nw, sparse=sparse)
+            if sparse:
+                agent.Qtable.init = lambda x, d: dense.data[dense.row_index(x, d)]
+                agent.rng.normal(0, 1, dense.data.size)  # what the dense initialization draws
+            nw.agent = agent
+            result = nw.train(duration, load, lr=lr, memory=True)
+            results.append(result['route_time'])
+            memory.append(result['memory'][-1])
+        assert np.array_equal(*results), cls
+        print(f"{file} {cls.__name__}: same, {agent.Qtable.row_count} of {len(agent.links) ** 2} rows used, "
+              f"{memory[0] / 1e6:.2f} MB dense vs {memory[1] / 1e6:.2f} MB sparse")
+    # the rows initialized on first use follow the rules of the dense tables
+    dense, sparse = CQ(Network('lata.net', seed=0)), CQ(Network('lata.net', seed=0), sparse=True)
+    x, d = dense.Qtable.row_keys()
+    for k in ('Qtable', 'confidence'):
+        values = [agent.__dict__[k].rows(x, d).ravel() for agent in (dense, sparse)]
+        # the Q-values the rule sets are 0 and -1, the others are drawn
+        fixed = np.isin(values[0], (0, -1)) if k == 'Qtable' else ~np.isnan(values[0])
+        assert np.array_equal(values[0][fixed], values[1][fixed]), k
+    print("initialization rules: same")
+    # a table pickles its rows only, not the free space after them, so the same agents pickle the same bytes
+    pickles = []
+    for _ in range(2):
+        nw = Network('6x6.net', seed=5)
+        nw.agent = Qroute(nw, sparse=True)
+        nw.train(duration, 2.0)
+        pickles.append(pickle.dumps(nw.agent.Qtable))
+    table = pickle.loads(pickles[0])
+    assert pickles[0] == pickles[1] and len(table.data) == table.row_start[table.row_count]
+    print(f"pickles: same, {len(pickles[0])} bytes for {table.row_count} rows")
+
+
+def bench_sparse(sizes=(1000, 3000, 10000), duration=200, load=2.0, dense_limit=3000):
+    """ the table memory and steps/sec of Qroute with dense and sparse tables on synthetic networks,
+    dense ones only up to `dense_limit` nodes (estimated above) """
+    print(f"{'nodes':>6} {'dense MB':>9} {'dense step/s':>12} {'sparse MB':>10} {'rows used':>10} {'sparse step/s':>13}")
+    for n in sizes:
+        file = synthetic_network(n)
+        row = []
+        for sparse in (False, True):
+            if not sparse and n > dense_limit:
+                degree = Network(file, seed=0).links
+                entries = sum(len(v) for v in degree.values()) * n
+                row += [f"~{(entries * 8 + n * n * 16) / 1e6:.0f}", "-"]
+                continue
+            nw = Network(file, seed=0)
+            nw.agent = Qroute(nw, sparse=sparse)
+            start = time.perf_counter()
+            memory = nw.train(duration, load, memory=True)['memory'][-1]
+            rate = duration / (time.perf_counter() - start)
+            row += [f"{memory / 1e6:.1f}", f"{rate:.1f}"]
+        used = nw.agent.Qtable.row_count / n ** 2
+        print(f"{n:>6} {row[0]:>9} {row[1]:>12} {row[2]:>10} {used:>10.2%} {row[3]:>13}")
+        os.remove(file)
+
+
+def check_dtype(runs=((Qroute, 1.0, {}), (CQ, 1.0, {}), (HybridQ, 1.0, {}), (MaHybridQ, 0.5, {'q': 0.1, 'p': 0.001})),
+                file='lata.net', seeds=range(4), duration=1500, tolerance=0.1):
+    """ the final route times of agents with float32 tables must be those of float64 ones within `tolerance`
+    (relative) or three standard errors over `seeds`; and a float16 snapshot must route as the agent stored """
+    for cls, load, lr in runs:
+        finals = {}
+        for dtype in (np.float64, np.float32):
+            for seed in seeds:
+                nw = Network(file, seed=seed)
+                nw.agent = cls(nw, dtype=dtype)
+                finals.setdefault(dtype, []).append(nw.train(duration, load, lr=lr)['route_time'][-1])
+        (mean64, mean32), error = [np.mean(finals[t]) for t in finals], np.std(finals[np.float64]) / np.sqrt(len(seeds))
+        assert abs(mean32 - mean64) <= max(tolerance * mean64, 3 * error), (cls, mean64, mean32)
+        print(f"{cls.__name__}: route time float64 {mean64:.2f}±{error:.2f}, float32 {mean32:.2f}")
+    agent = nw.agent  # the last float32 one
+    fd, snapshot = tempfile.mkstemp(suffix='.pkl')
+    os.close(fd)
+    agent.store(snapshot, dtype=np.float16)
+    loaded = type(agent)(Network(file, seed=0))
+    loaded.load(snapshot)
+    os.remove(snapshot)
+    same = (loaded._best == agent._best).mean()
+    error = np.abs(loaded.Qtable.data - agent.Qtable.data).max()
+    assert loaded.Qtable.data.dtype == np.float16 and same > 0.95
+    print(f"float16 snapshot: {same:.2%} of greedy next hops kept, Q-values within {error:.3f}")
+
+
+def bench_dtype(file='lata.net', sizes=(1000, 3000), dtypes=(np.float64, np.float32), rows=100000, duration=300):
+    """ per table dtype: the bytes of agent tables, the time to find the greedy action of random rows
+    (memory bound once tables outgrow the caches) and the rewards/sec of `learn` on recorded steps """
+    print(f"{'policy':>10} " + " ".join(f"{t.__name__ + ' MB':>12} {t.__name__ + ' learn/s':>15}" for t in dtypes))
+    for cls, lr in ((Qroute, {}), (CQ, {}), (HybridQ, {}), (MaHybridQ, {'q': 0.1, 'p': 0.001})):
+        line = []
+        for dtype in dtypes:
+            nw = Network(file, seed=0)
+            nw.agent = cls(nw, dtype=dtype)
+            nw.train(duration, 1.0, lr=lr)
+            steps = []
+            for _ in range(duration):
+                nw.inject(nw.new_packet(1.0))
+                steps.append(nw.step(1))
+            rewards = sum(len(r) for r in steps)
+            line.append(f"{sum(nw.agent.memory().values()) / 1e6:>12.2f}")
+            line.append(f"{rewards / _timeit(lambda: [nw.agent.learn(r, lr) if lr else nw.agent.learn(r) for r in steps], 1):>15.0f}")
+        print(f"{cls.__name__:>10} " + " ".join(line))
+    print(f"{'network':>16} " + " ".join(f"{t.__name__ + ' MB':>12} {t.__name__ + ' ns/row':>14}" for t in dtypes))
+    for name, file in [(file, file)] + [(f"synthetic {n}", synthetic_network(n)) for n in sizes]:
+        line = []
+        for dtype in dtypes:
+            agent = Qroute(Network(file, seed=0), dtype=dtype)
+            rng = np.random.default_rng(0)
+            x, d = rng.integers(0, len(agent.links), (2, rows))
+            line.append(f"{agent.Qtable.nbytes / 1e6:>12.2f}")
+            line.append(f"{_timeit(lambda: agent.Qtable.row_argmax(x, d)) / rows * 1e9:>14.1f}")
+        print(f"{name:>16} " + " ".join(line))
+        if file != name:
+            os.remove(file)
+
+
+def check_checkpoint(file='lata.net', duration=300):
+    """ agents loaded from checkpoints, in memory, read-only or copy-on-write, must have the tables stored
+    and go on learning alike, without writing the files; storing again must only write the tables changed """
+    directory = tempfile.mkdtemp()
+    for cls, kwargs in ((Qroute, {}), (CQ, {'sparse': True}), (HybridQ, {}), (MaHybridQ, {}), (Shortest, {})):
+        nw = Network(file, seed=0)
+        nw.agent = cls(nw, **kwargs)
+        nw.train(duration, 1.0)
+        nw.agent.store_checkpoint(directory)
+        assert nw.agent.store_checkpoint(directory) == []
+        files = {name: open(os.path.join(directory, name), 'rb').read() for name in os.listdir(directory)}
+        results = []
+        for mode in (None, 'r', 'c'):
+            agent = cls(Network(file, seed=1), **kwargs)
+            agent.load(directory, mmap_mode=mode)
+            for k, v in vars(nw.agent).items():
+                if k in cls.attrs and hasattr(v, 'data'):
+                    # a SparseTable stores the rows it materialized, not its free space
+                    assert np.array_equal(agent.__dict__[k].data, v.data[:len(agent.__dict__[k].data)]), (cls, mode, k)
+            if mode != 'r' and cls is not Shortest:
+                run = Network(file, seed=2)
+                run.agent = agent
+                results.append(run.train(duration, 1.0)['route_time'])
+        assert all(np.array_equal(r, results[0]) for r in results), cls
+        assert files == {name: open(os.path.join(directory, name), 'rb').read() for name in os.listdir(directory)}
+        print(f"{cls.__name__}: same, {len(files) - 2} array files")
+    # a sparse agent mapped read-only routes to the rows it did not store too, added in memory
+    nw = Network(file, seed=0)
+    nw.agent = Qroute(nw, sparse=True)
+    nw.train(duration, 1.0)
+    shutil.rmtree(directory)
+    nw.agent.store_checkpoint(directory)
+    files = {name: open(os.path.join(directory, name), 'rb').read() for name in os.listdir(directory)}
+    choices = []
+    for mode in (None, 'r'):
+        agent = Qroute(Network(file, seed=1), sparse=True)
+        agent.load(directory, mmap_mode=mode)
+        stored, n = agent.Qtable.row_count, len(agent.links)
+        choices.append([agent.choose(x, z) for x in range(n) for z in range(n) if x != z])
+    assert choices[0] == choices[1]
+    assert files == {name: open(os.path.join(directory, name), 'rb').read() for name in os.listdir(directory)}
+    print(f"sparse Qroute read-only: same choices, {agent.Qtable.row_count - stored} rows added to {stored}")
+    # fine-tuning the Q-values only rewrites the Q-table
+    nw = Network(file, seed=0)
+    nw.agent = HybridQ(nw)
+    nw.train(duration, 1.0)
+    nw.agent.store_checkpoint(directory)
+    nw.train(duration, 1.0, lr={'q': 0.1, 'p': 0.0, 'e': 0.0})
+    written = nw.agent.store_checkpoint(directory)
+    assert [name.split('-')[0] for name in written] == ['Qtable'], written
+    print(f"HybridQ fine-tuned: wrote {written}")
+    shutil.rmtree(directory)
+
+
+def _load_cost(agent, *args):
+    " the seconds and the peak of memory allocated to load `agent` "
+    tracemalloc.start()
+    start = time.perf_counter()
+    agent.load(*args)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def bench_checkpoint(sizes=(1000, 3000), duration=50):
+    """ the time to store and load a trained HybridQ agent (Q-table and theta), by pickle or as checkpoints,
+    the memory allocated in loading, and an incremental checkpoint after fine-tuning the Q-values only """
+    print(f"{'nodes':>6} {'tables MB':>9} {'format':>18} {'store s':>8} {'load s':>7} {'load MB':>8}")
+    for n in sizes:
+        file = synthetic_network(n)
+        nw = Network(file, seed=0)
+        nw.agent = HybridQ(nw)
+        nw.train(duration, 1.0)
+        tables = (nw.agent.Qtable.nbytes + nw.agent.Theta.nbytes) / 1e6
+        directory = tempfile.mkdtemp()
+        pickled = os.path.join(directory, 'agent.pkl')
+        checkpoint = os.path.join(directory, 'checkpoint')
+        runs = [('pickle', lambda: nw.agent.store(pickled), (pickled,)),
+                ('checkpoint', lambda: nw.agent.store_checkpoint(checkpoint), (checkpoint,)),
+                ('checkpoint mmap r', None, (checkpoint, 'r')),
+                ('checkpoint mmap c', None, (checkpoint, 'c'))]
+        for name, store, args in runs:
+            stored = _timeit(store, 1) if store else None
+            agent = HybridQ(Network(file, seed=0))
+            seconds, peak = _load_cost(agent, *args)
+            del agent
+            print(f"{n:>6} {tables:>9.1f} {name:>18} {'' if stored is None else f'{stored:.2f}':>8} "
+                  f"{seconds:>7.2f} {peak / 1e6:>8.1f}")
+        nw.train(duration, 1.0, lr={'q': 0.1, 'p': 0.0, 'e': 0.0})
+        start = time.perf_counter()
+        written = nw.agent.store_checkpoint(checkpoint)
+        stored = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(checkpoint, name)) for name in written) / 1e6
+        print(f"{n:>6} {tables:>9.1f} {'incremental':>18} {stored:>8.2f} {'':>7} {'':>8}  ({size:.1f} MB written)")
+        shutil.rmtree(directory)
+        os.remove(file)
+
+
+def check_frozen(file='lata.net', duration=500, load=1.0):
+    """ FrozenPolicy must route as the agent it is compiled from does when that agent learns nothing,
+    drawing the choices of PolicyGradient agents from a copy of the agent's random stream """
+    for cls, kwargs in ((Qroute, {}), (CQ, {}), (CDRQ, {}), (HybridQ, {}), (HybridQ, {'sparse': True}),
+                        (MaHybridQ, {}), (Shortest, {}), (Qroute, {'sparse': True})):
+        nw = Network(file, seed=0)
+        nw.agent = cls(nw, **kwargs)
+        if cls is not Shortest:
+            nw.train(duration, load)
+        agent = nw.agent
+        rows = getattr(agent.__dict__.get('Qtable'), 'row_count', None)
+        frozen = FrozenPolicy(Network(file, seed=1), agent)
+        assert getattr(agent.__dict__.get('Qtable'), 'row_count', None) == rows  # compiled without materializing
+        if rows is not None and not frozen.stochastic:
+            # the rows not used yet are drawn apart, the others must give the agent's choices
+            x, d = agent.Qtable.row_keys()
+            assert (frozen.hop[x, d] == agent._best.values[:rows]).all()
+            print(f"{cls.__name__} {kwargs}: same greedy choices on the {rows} rows used")
+            continue
+        results = []
+        for policy in (copy.deepcopy(agent), frozen):
+            run = Network(file, seed=1)
+            if policy is frozen:
+                policy.rng = copy.deepcopy(agent.rng)
+            else:
+                policy.learn = lambda rewards, lr={}: None
+            run.agent = policy
+            results.append(run.train(duration, load, hop=True))
+        assert all(np.array_equal(results[0][k], results[1][k]) for k in results[0]), (cls, kwargs)
+        print(f"{cls.__name__} {kwargs}: same, route time {results[1]['route_time'][-1]:.2f}")
+    for agent in (BackPressure(Network(file)), Shortest(Network(file), multiway=True, random=True)):
+        try:
+            FrozenPolicy(Network(file), agent)
+        except TypeError:
+            continue
+        raise AssertionError(f"{agent} must not be frozen")
+    print("BackPressure, random Shortest: not frozen")
+
+
+def bench_frozen(sizes=(1000,), duration=300, load=1.0):
+    """ the steps/sec of evaluating trained agents as they are, learning, and frozen (see FrozenPolicy) """
+    print(f"{'network':>16} {'policy':>8} {'compile s':>9} {'table MB':>8} {'learning step/s':>15} {'frozen step/s':>13}")
+    for name, file in [('lata.net', 'lata.net')] + [(f"synthetic {n}", synthetic_network(n)) for n in sizes]:
+        for cls in (Qroute, HybridQ, Shortest):
+            nw = Network(file, seed=0)
+            nw.agent = cls(nw)
+            if cls is not Shortest:
+                nw.train(duration, load)
+            agent = copy.deepcopy(nw.agent)
+            live = Network(file, seed=1)
+            live.agent = agent
+            learning = duration / _timeit(lambda: live.train(duration, load), 1)
+            start = time.perf_counter()
+            frozen = FrozenPolicy(Network(file, seed=1), nw.agent)
+            compiled = time.perf_counter() - start
+            run = Network(file, seed=1)
+            run.agent = frozen
+            rate = duration / _timeit(lambda: run.train(duration, load), 1)
+            print(f"{name:>16} {cls.__name__:>8} {compiled:>9.2f} {sum(frozen.memory().values()) / 1e6:>8.2f} "
+                  f"{learning:>15.0f} {rate:>13.0f}")
+        if file != name:
+            os.remove(file)
+
+
+def check_profile(file='lata.net', duration=300, load=1.0):
+    """ profiling must not change a run, its counters must agree with the network's,
+    the agent must copy without the wrappers, and stopping it must restore the methods it wrapped """
+    for cls in (Qroute, HybridQ, Shortest):
+        results = []
+        for profiled in (False, True):
+            nw = Network(file, seed=0, is_drop=True)
+            nw.agent = cls(nw)
+            if profiled:
+                nw.profile()
+            results.append(nw.train(duration, load, droprate=True))
+        profile = results[1].pop('profile')
+        assert all(np.array_equal(results[0][k], results[1][k]) for k in results[0]), cls
+        counters = {k: v['total'] for k, v in profile['counters'].items()}
+        assert counters['ended'] == nw.end_packets and counters['dropped'] == nw.drop_packets
+        assert counters['sent'] == counters['events'] + len(nw.event_queue)
+        assert profile['phases']['send']['calls'] >= counters['sent'] and profile['steps'] == duration
+        # the agent copies, pickles and stores without the wrappers while profiled
+        copied = copy.deepcopy(nw.agent)
+        assert not any(k in vars(copied) for k in ('learn', 'choose', 'get_info_batch')), cls
+        fd, filename = tempfile.mkstemp(suffix='.pkl')
+        os.close(fd)
+        nw.agent.store(filename)
+        os.remove(filename)
+        nw.profile(False)
+        assert not any(k in vars(obj) for obj, k in [(nw, 'step'), (nw, '_deliver'), (nw.agent, 'learn'),
+                                                     (nw.agent, 'choose'), (nw.nodes[0], 'send')])
+        print(f"{cls.__name__}: same, {counters}")
+
+
+def bench_profile(file='lata.net', duration=300, load=1.0):
+    """ the steps/sec of training not profiled, profiled, and after profiling stopped,
+    and the share of each phase in a profiled run """
+    for cls in (Qroute, HybridQ, Shortest):
+        rates, profile = [], None
+        for profiled in ('never', 'on', 'stopped'):
+            nw = Network(file, seed=0)
+            nw.agent = cls(nw)
+            if profiled != 'never':
+                nw.profile()
+            if profiled == 'stopped':
+                nw.profile(False)
+            start = time.perf_counter()
+            result = nw.train(duration, load)
+            rates.append(duration / (time.perf_counter() - start))
+            profile = result.get('profile', profile)
+        total = profile['phases']['step']['seconds'] + profile['phases']['learn']['seconds']
+        shares = " ".join(f"{k} {v['seconds'] / total:.0%}" for k, v in profile['phases'].items() if k != 'step')
+        print(f"{cls.__name__:>8}: step/s never {rates[0]:.0f}, on {rates[1]:.0f}, stopped {rates[2]:.0f}; {shares}")
+
+
+def _fixed_point_distance(agent, unit):
+    """ the former `Shortest._calc_distance`, relaxing all links until nothing changes
+
+    Returns:
+        distance, choice: the distances and ALL shortest next hops.
+    """
+    distance = np.full_like(agent.distance, np.inf)
+    np.fill_diagonal(distance, 0)
+    choice = {x: np.zeros_like(c) for x, c in agent.choice.items()}
+    changing = True
+    while changing:
+        changing = False
+        for x, neighbors in agent.links.items():
+            for y in neighbors:
+                for z in agent.links.keys():
+                    new_dis = distance[y, z] + unit[y]
+                    if distance[x, z] > new_dis:
+                        distance[x, z] = new_dis
+                        choice[x][z, :].fill(False)
+                        choice[x][z, agent.action_idx[x][y]] = True
+                        changing = True
+                    if np.isfinite(new_dis) and distance[x, z] == new_dis:
+                        choice[x][z, agent.action_idx[x][y]] = True
+    return distance, choice
+
+
+def check_shortest(files=('6x6.net', 'lata.net')):
+    """ compares the distances and next-hop choices of `Shortest`/`GlobalRoute`
+    with the fixed-point relaxation they replaced, for unit and random node weights.
+    """
+    rng = np.random.RandomState(0)
+    for file in files:
+        nw = Network(file)
+        for cls, queue in [(Shortest, None), (GlobalRoute, rng.randint(0, 5, len(nw.nodes)))]:
+            for multiway in [False, True]:
+                agent = cls(nw, multiway=multiway)
+                if queue is not None:
+                    agent.queue_size[:] = queue
+                    agent.learn([])
+                distance, choice = _fixed_point_distance(agent, agent._unit())
+                assert np.array_equal(agent.distance, distance), (file, cls, multiway)
+                for x in agent.links:
+                    if multiway:
+                        assert np.array_equal(agent.choice[x], choice[x]), (file, cls, x)
+                    else:  # exactly one of the shortest next hops
+                        reachable = choice[x].any(axis=1)
+                        assert (agent.choice[x].sum(axis=1) == reachable).all(), (file, cls, x)
+                        assert not (agent.choice[x] & ~choice[x]).any(), (file, cls, x)
+        print(f"{file}: ok")
+
+
+def bench_shortest(sizes=(100, 1000, 3000)):
+    " construction time of `Shortest` and `GlobalRoute` on lata.net and synthetic networks "
+    files = [('lata.net', 'lata.net')] + [(f"synthetic {n}", synthetic_network(n)) for n in sizes]
+    print(f"{'network':>16} {'Shortest s':>12} {'GlobalRoute s':>14}")
+    for name, file in files:
+        nw = Network(file)
+        print(f"{name:>16} {_timeit(lambda: Shortest(nw), 1):>12.3f} "
+              f"{_timeit(lambda: GlobalRoute(nw), 1):>14.3f}")
+        if file != name:
+            os.remove(file)
+
+
+def bench_global_route(runs=(('6x6.net', 0.5), ('6x6.net', 2.0), ('lata.net', 0.5), ('lata.net', 2.0)),
+                       duration=500, thresholds=(0.0, 1.0)):
+    " steps/sec of `GlobalRoute` recomputing all paths on every step and as its `threshold` allows "
+    def full(agent):
+        def learn(rewards, lr={}):
+            agent._calc_distance()
+        return learn
+
+    print(f"{'network':>10} {'load':>5} {'full step/s':>12}" +
+          "".join(f" {f'threshold {t} step/s':>20} {'route time':>10}" for t in thresholds))
+    for file, load in runs:
+        rates = []
+        for threshold in (None,) + tuple(thresholds):
+            np.random.seed(0)
+            nw = Network(file)
+            nw.agent = GlobalRoute(nw, threshold=threshold or 0.0)
+            if threshold is None:
+                nw.agent.learn = full(nw.agent)
+            start = time.perf_counter()
+            result = nw.train(duration, load)['route_time']
+            rates.append((duration / (time.perf_counter() - start), result))
+        assert np.array_equal(rates[0][1], rates[1][1]), "threshold 0 must follow every change"
+        print(f"{file:>10} {load:>5} {rates[0][0]:>12.1f}" +
+              "".join(f" {rate:>20.1f} {result[-1]:>10.2f}" for rate, result in rates[1:]))
+
+
+def check_agents(file='6x6.net', duration=100, load=1.0):
+    """ every policy, dense and sparse, must build, train and load what it stored,
+    including the hybrids whose `_refresh` needs tables of more than one base
+    (DRQ, HybridCQ and HybridCDRQ are only built: their `_update` reads info their `get_info` does not give) """
+    fd, filename = tempfile.mkstemp(suffix='.pkl')
+    os.close(fd)
+    runs = [(cls, {}) for cls in (Shortest, GlobalRoute, BackPressure)] + \
+           [(cls, kwargs) for cls in (Qroute, CQ, CDRQ, DRQ, PolicyGradient, HybridQ, HybridCQ, HybridCDRQ, MaHybridQ)
+            for kwargs in ({}, {'sparse': True})]
+    for cls, kwargs in runs:
+        nw = Network(file, seed=0)
+        nw.agent = cls(nw, **kwargs)
+        if cls not in (DRQ, HybridCQ, HybridCDRQ):
+            nw.train(duration, load)
+        nw.agent.store(filename)
+        agent = cls(Network(file, seed=1), **kwargs)
+        agent.load(filename)
+        for k in cls.attrs & set(vars(nw.agent)):
+            stored, loaded = nw.agent.__dict__[k], agent.__dict__[k]
+            if hasattr(stored, 'data'):
+                assert np.array_equal(loaded.data, stored.data[:len(loaded.data)]), (cls, kwargs, k)
+        print(f"{cls.__name__} {kwargs}: ok, {nw.all_packets} packets")
+    os.remove(filename)
+
+
+def bench_policy_choose(file='lata.net', decisions=20000):
+    """ decisions/sec of `PolicyGradient.choose` sampling from cached distributions,
+    versus `rng.choice` on the softmax and versus `choose_many` over a whole queue.
+    """
+    nw = Network(file)
+    agent = PolicyGradient(nw)
+    agent.Theta.data[:] = np.random.normal(0, 1, agent.Theta.data.size)
+    nodes = len(nw.nodes)
+    sources = np.random.randint(0, nodes, decisions)
+    dests = (sources + np.random.randint(1, nodes, decisions)) % nodes
+
+    def softmax():
+        for x, d in zip(sources, dests):
+            agent.rng.choice(agent.links[x], p=agent._softmax(x, d))
+
+    def cached():
+        for x, d in zip(sources, dests):
+            agent.choose(x, d)
+
+    def many(queue=50):
+        for i in range(0, decisions, queue):
+            agent.choose_many(sources[i], dests[i:i+queue])
+
+    for name, func in [('rng.choice', softmax), ('choose', cached), ('choose_many (50)', many)]:
+        print(f"{name:>18}: {decisions / _timeit(func):>10.0f} decisions/s")
+
+
+def bench_trace(sizes=(100, 600), duration=300, load=0.5):
+    """ steps/sec of `MaHybridQ` training, pruning its eligibility trace at the default `trace_epsilon`
+    versus keeping every entry ever added (`trace_epsilon=0`), with the resulting route time.
+    """
+    files = [('6x6.net', '6x6.net'), ('lata.net', 'lata.net')] + \
+        [(f"synthetic {n}", synthetic_network(n)) for n in sizes]
+    print(f"{'network':>16} {'keep all step/s':>16} {'pruned step/s':>14} {'route time':>11}")
+    for name, file in files:
+        rates = []
+        for epsilon in (0.0, 1e-6):
+            np.random.seed(0)
+            nw = Network(file)
+            nw.agent = MaHybridQ(nw, trace_epsilon=epsilon)
+            start = time.perf_counter()
+            result = nw.train(duration, load, lr={'q': 0.1, 'p': 0.001})['route_time']
+            rates.append(duration / (time.perf_counter() - start))
+        print(f"{name:>16} {rates[0]:>16.1f} {rates[1]:>14.1f} {result[-1]:>11.2f}")
+        if file != name:
+            os.remove(file)
+
+
+def bench_backpressure(files=('6x6.net', 'lata.net'), loads=(1.0, 2.0, 3.0, 4.0, 5.0), duration=1000):
+    """ the final average route time and the delivered ratio of packets of `BackPressure`
+    against `Qroute` and `CQ`, up to the loads where those collapse.
+    """
+    agents = [('Qroute', Qroute), ('CQ', CQ),
+              ('BP', lambda nw: BackPressure(nw, bias=0.0)), ('BP bias 1', BackPressure)]
+    print(f"{'network':>10} {'load':>5}" + "".join(f" {name + ' time':>16} {'delivered':>9}" for name, _ in agents))
+    for file in files:
+        for load in loads:
+            row = f"{file:>10} {load:>5}"
+            for _, agent in agents:
+                np.random.seed(0)
+                nw = Network(file)
+                nw.agent = agent(nw)
+                route_time = nw.train(duration, load)['route_time'][-1]
+                row += f" {route_time:>16.2f} {nw.end_packets / nw.all_packets:>9.3f}"
+            print(row)
+
+
+BENCHMARKS = {
+    'event_queue': bench_event_queue,
+    'dest_queue': bench_dest_queue,
+    'active_nodes': bench_active_nodes,
+    'packets': bench_packets,
+    'traffic': bench_traffic,
+    'check_trace': check_trace,
+    'trace_replay': bench_trace_replay,
+    'sweep': bench_sweep,
+    'batch_env': bench_batch_env,
+    'check_parallel': check_parallel,
+    'parallel': bench_parallel,
+    'check_sparse': check_sparse,
+    'sparse': bench_sparse,
+    'check_dtype': check_dtype,
+    'dtype': bench_dtype,
+    'check_checkpoint': check_checkpoint,
+    'checkpoint': bench_checkpoint,
+    'check_frozen': check_frozen,
+    'frozen': bench_frozen,
+    'check_profile': check_profile,
+    'profile': bench_profile,
+    'check_shortest': check_shortest,
+    'check_info_batch': check_info_batch,
+    'check_rng_streams': check_rng_streams,
+    'shortest': bench_shortest,
+    'global_route': bench_global_route,
+    'check_agents': check_agents,
+    'policy_choose': bench_policy_choose,
+    'trace': bench_trace,
+    'backpressure': bench_backpressure,
+}
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or BENCHMARKS:
+        print(f"== {name}")
+        BENCHMARKS[name]()
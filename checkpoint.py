@@ -0,0 +1,120 @@
+import os
+import io
+import json
+import pickle
+import hashlib
+import numpy as np
+
+# a checkpoint is a directory of this manifest, a pickle of the state and one .npy file per large array
+MANIFEST = 'manifest.json'
+FORMAT = 'QRCKPT1'
+# arrays smaller than this stay in the pickle
+MIN_BYTES = 4096
+MMAP_MODES = (None, 'r', 'c')
+
+
+def _digest(array):
+    return hashlib.blake2b(np.ascontiguousarray(array), digest_size=16).hexdigest()
+
+
+def _replace(path, write):
+    " write a file by `write(f)` next to `path`, then move it to `path` at once "
+    with open(path + '.tmp', 'wb') as f:
+        write(f)
+    os.replace(path + '.tmp', path)
+
+
+class _Pickler(pickle.Pickler):
+    """ pickles the state with every large array replaced by the name of its .npy file,
+    named after the attribute and the content, so an array already in the directory is not written again """
+    def __init__(self, f, directory):
+        super().__init__(f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.directory = directory
+        self.attr = None
+        self.arrays = {}  # file -> {'dtype', 'shape', 'written'}
+
+    def persistent_id(self, obj):
+        if type(obj) is not np.ndarray or obj.nbytes < MIN_BYTES or obj.dtype.hasobject:
+            return None
+        name = f"{self.attr}-{_digest(obj)}.npy"
+        if name not in self.arrays:
+            path = os.path.join(self.directory, name)
+            written = not os.path.exists(path)
+            if written:
+                _replace(path, lambda f: np.save(f, obj, allow_pickle=False))
+            self.arrays[name] = {'dtype': obj.dtype.str, 'shape': list(obj.shape), 'written': written}
+        return name
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, f, directory, mmap_mode):
+        super().__init__(f)
+        self.directory = directory
+        self.mmap_mode = mmap_mode
+
+    def persistent_load(self, name):
+        array = np.load(os.path.join(self.directory, name), mmap_mode=self.mmap_mode, allow_pickle=False)
+        # a plain ndarray over the mapping, which it keeps open, as np.memmap slows every operation
+        return array.view(np.ndarray)
+
+
+def write_checkpoint(directory, state):
+    """ write `state`, a dictionary of picklable values, as a checkpoint in `directory`.
+
+    The arrays of at least MIN_BYTES in `state` (the buffers of Tables, ...) are saved as .npy files,
+    whose data is aligned to be memory-mapped. An array already saved in the directory by an earlier
+    checkpoint is kept, so an incremental snapshot only writes the arrays changed since.
+    The manifest is replaced last, so the directory holds the last complete checkpoint at any time,
+    and files no longer in it are removed after.
+
+    Returns:
+        List[str]: the array files written.
+    """
+    os.makedirs(directory, exist_ok=True)
+    old = _read_manifest(directory) if os.path.exists(os.path.join(directory, MANIFEST)) else None
+    buffer = io.BytesIO()
+    pickler = _Pickler(buffer, directory)
+    # one pickler for all attributes, so objects they share (links) are pickled once
+    for k in sorted(state):
+        pickler.attr = k
+        pickler.dump(state[k])
+    pickled = buffer.getvalue()
+    name = f"state-{hashlib.blake2b(pickled, digest_size=16).hexdigest()}.pkl"
+    _replace(os.path.join(directory, name), lambda f: f.write(pickled))
+    manifest = {
+        'format': FORMAT,
+        'state': name,
+        'attrs': sorted(state),
+        'arrays': {k: {'dtype': v['dtype'], 'shape': v['shape']} for k, v in pickler.arrays.items()},
+    }
+    _replace(os.path.join(directory, MANIFEST), lambda f: f.write(json.dumps(manifest, indent=1).encode()))
+    if old is not None:
+        for stale in set([old['state']] + list(old['arrays'])) - set([name] + list(manifest['arrays'])):
+            os.remove(os.path.join(directory, stale))
+    return [k for k, v in pickler.arrays.items() if v['written']]
+
+
+def _read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST), 'rb') as f:
+        manifest = json.loads(f.read())
+    if manifest.get('format') != FORMAT:
+        raise ValueError(f"{directory} is not a checkpoint")
+    return manifest
+
+
+def read_checkpoint(directory, mmap_mode=None):
+    """ the state written by `write_checkpoint` to `directory`
+
+    Args:
+        mmap_mode: how to read the arrays of .npy files: None reads them into memory,
+            'r' maps them read-only, and 'c' copy-on-write: changes stay in memory, the files are never written.
+
+    Returns:
+        Dict
+    """
+    if mmap_mode not in MMAP_MODES:
+        raise ValueError(f"mmap_mode must be one of {MMAP_MODES}, got {mmap_mode!r}")
+    manifest = _read_manifest(directory)
+    with open(os.path.join(directory, manifest['state']), 'rb') as f:
+        unpickler = _Unpickler(f, directory, mmap_mode)
+        return {k: unpickler.load() for k in manifest['attrs']}
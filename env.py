@@ -1,9 +1,13 @@
 import numpy as np
 import logging
-from collections import OrderedDict
-from heapq import *
+import itertools
+from collections import OrderedDict, defaultdict, deque
+from heapq import heappush, heappop, merge
+from operator import itemgetter
 
 from base_policy import Policy
+from traffic import UniformTraffic
+from profiling import PhaseProfiler
 
 
 class Packet:
@@ -15,13 +19,17 @@ class Packet:
     Attributes:
         trans_time (int): Transmission time.
         hops (int): The number of hops.
+        start_queue (int): When the packet entered the queue of its current node.
     """
+    __slots__ = ('source', 'dest', 'birth', 'hops', 'trans_time', 'start_queue')
+
     def __init__(self, source, dest, birth):
         self.source = source
         self.dest = dest
         self.birth = birth
         self.hops = 0
         self.trans_time = 0
+        self.start_queue = birth
 
     def __repr__(self):
         return f"Packet<{self.source}->{self.dest}>"
@@ -36,6 +44,8 @@ class Event:
         to_node     (int)   : Where the delivery ends, the destination.
         arrive_time (int)   : When the corresponding packet would arrive to_node.
     """
+    __slots__ = ('packet', 'from_node', 'to_node', 'arrive_time')
+
     def __init__(self, packet, from_node, to_node, arrive_time):
         self.packet = packet
         self.from_node = from_node
@@ -49,8 +59,81 @@ class Event:
         return self.arrive_time < other.arrive_time
 
 
+class EventQueue:
+    """ EventQueue schedules the in-flight Events in order of `arrive_time`.
+
+    Peeking reads the heap root, so both pushing and popping an Event cost O(log n)
+    in the number of packets under delivery.
+    """
+    def __init__(self):
+        self._heap = []
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __repr__(self):
+        return f"EventQueue<{len(self._heap)} events>"
+
+    def push(self, event):
+        heappush(self._heap, event)
+
+    def peek(self):
+        " the next Event to happen, None if empty "
+        return self._heap[0] if self._heap else None
+
+    def pop_until(self, end_time):
+        """ Pops the Events arriving no later than `end_time` in time order.
+
+        Returns:
+            Iterator[Event]
+        """
+        heap = self._heap
+        while heap and heap[0].arrive_time <= end_time:
+            yield heappop(heap)
+
+
+class DestQueue:
+    """ DestQueue is a node queue indexed by destination, one FIFO per destination.
+
+    Packets of a destination leave in arrival order, so `pop(dest)` returns the packet
+    `next(p for p in queue if p.dest == dest)` finds in a plain list, in O(1).
+    Iterating gives all packets in arrival order too, as the list would.
+
+    Args:
+        count (np.array(Int)): the number of queued packets of each destination,
+            updated in place (a row of `Network.queue_count`).
+    """
+    def __init__(self, count):
+        self.count = count
+        self._queues = defaultdict(deque)  # dest -> deque of (arrival number, packet)
+        self._arrivals = itertools.count()
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for _, packet in merge(*self._queues.values(), key=itemgetter(0)):
+            yield packet
+
+    def __repr__(self):
+        return f"DestQueue{list(self)}"
+
+    def append(self, packet):
+        self._queues[packet.dest].append((next(self._arrivals), packet))
+        self.count[packet.dest] += 1
+        self._len += 1
+
+    def pop(self, dest):
+        " the first queued packet of `dest` "
+        _, packet = self._queues[dest].popleft()
+        self.count[dest] -= 1
+        self._len -= 1
+        return packet
+
+
 class Reward:
-    """ Reward defines the backward reward from environment (what Network.step returns)
+    """ Reward defines the backward reward from environment (a row of what Network.step returns)
 
     Attributes:
         source (int): Where the packet sent from at the last step, NOT where the packet begins.
@@ -59,6 +142,8 @@ class Reward:
         packet (Packet): the corresponding packet.
         agent_info (Dict): Extra information from agent.get_info
     """
+    __slots__ = ('source', 'dest', 'action', 'packet', 'agent_info')
+
     def __init__(self, source, packet, action, agent_info={}):
         self.source = source
         self.dest = packet.dest
@@ -70,35 +155,128 @@ class Reward:
         return f"Reward<{self.source}->{self.dest} by {self.action}>"
 
 
+class RewardBatch:
+    """ RewardBatch holds the Rewards of a step column by column (what Network.step returns).
+
+    Nodes append a row for each packet sent, with the environment entries of `agent_info`,
+    and `agent.get_info_batch` adds the agent's entries for all rows at once.
+    `column` reads a column as an array, so a policy can learn from all rewards in one go,
+    while iterating gives the `Reward`s to policies learning one by one.
+
+    Attributes:
+        source, action, dest (List[int]): the columns of `Reward` attributes.
+        packets (List[Packet]): the corresponding packets.
+        info (Dict[str, List]): the `agent_info` entries, column by column; all rows have the same keys.
+    """
+    int_columns = ('source', 'action', 'dest', 'packet_source')
+
+    def __init__(self):
+        self.source = []
+        self.action = []
+        self.dest = []
+        self.packets = []
+        self.info = defaultdict(list)
+        self._arrays = {}
+
+    @classmethod
+    def from_rewards(cls, rewards):
+        " a RewardBatch of the `Reward`s given, or `rewards` itself if it is a RewardBatch "
+        if isinstance(rewards, cls):
+            return rewards
+        batch = cls()
+        for reward in rewards:
+            batch.append(reward.source, reward.packet, reward.action)
+            for k, v in reward.agent_info.items():
+                batch.info[k].append(v)
+        return batch
+
+    def __len__(self):
+        return len(self.source)
+
+    def __getitem__(self, i):
+        return Reward(self.source[i], self.packets[i], self.action[i],
+                      {k: v[i] for k, v in self.info.items()})
+
+    def __iter__(self):
+        for i in range(len(self.source)):
+            yield self[i]
+
+    def __repr__(self):
+        return f"RewardBatch<{len(self)} rewards, info: {list(self.info)}>"
+
+    def append(self, source, packet, action):
+        " a row for `packet` sent from `source` to `action`, its `info` entries appended apart "
+        self.source.append(source)
+        self.action.append(action)
+        self.dest.append(packet.dest)
+        self.packets.append(packet)
+        if self._arrays:
+            self._arrays.clear()
+
+    def column(self, key):
+        """ the column `key` as an array:
+        'source', 'action', 'dest', 'packet_source' (where packets begin) or an `info` entry
+        """
+        if key not in self._arrays:
+            if key == 'packet_source':
+                values = [p.source for p in self.packets]
+            elif key in self.int_columns:
+                values = getattr(self, key)
+            else:
+                values = self.info[key]
+            self._arrays[key] = np.array(values, dtype=int if key in self.int_columns else np.float64)
+        return self._arrays[key]
+
+
 class Node:
     """ Node is the unit in a network.
 
     Attributes:
         queue (List[Packet]): Where Packets waiting for being delivered.
+            A DestQueue in 'bp' mode, where packets are sent by destination.
         sent  (Dict[int, int]): An pseudo stage where Packets already sent but not arrive the next node yet.
             For instance, 'thisNode.sent[9] = 2' means 'the directed connection between `thisNode` and Node 9 has 2 packets under delivery'
+        _avaliable (List[bool]): whether the connection to each neighbor (in `links` order) has free bandwidth,
+            kept up to date on sending and on `release`.
     """
     def __init__(self, ID, network):
         self.ID = ID
         self.network = network
-        self.reset()
-
+        self.queue = []
         self.set_mode(None)
+        self.reset()
 
     def set_mode(self, mode):
         if mode == 'bp':
-            self.send = self._send_bp
+            self._send = self._send_bp
             self._build_info = self._build_info_default
         elif mode == 'dual':
-            self.send = self._send_default
+            self._send = self._send_default
             self._build_info = self._build_info_dual
+        elif mode == 'frozen':
+            self._send = self._send_frozen
+            self._build_info = None
         else:
-            self.send = self._send_default
+            self._send = self._send_default
             self._build_info = self._build_info_default
+        # move the queued packets to the queue of the new mode
+        packets, self.mode = self.queue, mode
+        self.queue = self._new_queue()
+        for p in packets:
+            self.queue.append(p)
+
+    def _new_queue(self):
+        if self.mode == 'bp':
+            return DestQueue(self.network.queue_count[self.ID])
+        return []  # Priority Queue
 
     def reset(self):
-        self.queue = []  # Priority Queue
+        self.queue = self._new_queue()
         self.sent = dict.fromkeys(self.links, 0)
+        self._link_idx = {y: i for i, y in enumerate(self.links)}
+        self._avaliable = [self.network.bandwidth > 0] * len(self.links)
+        self._free = sum(self._avaliable)  # the number of avaliable connections
+        self.network.active.discard(self.ID)
 
     @property
     def clock(self):
@@ -115,6 +293,22 @@ class Node:
     def is_avaliable(self, action):
         return self.sent[action] < self.network.bandwidth
 
+    def _update_active(self):
+        " keep this node in `network.active` while it has packets to send and connections to send to "
+        if self._free > 0 and len(self.queue) > 0:
+            self.network.active.add(self.ID)
+        else:
+            self.network.active.discard(self.ID)
+
+    def release(self, action):
+        " a packet sent to Node `action`(int) arrives, freeing its connection "
+        self.sent[action] -= 1
+        if self.sent[action] == self.network.bandwidth - 1:  # it was full
+            self._avaliable[self._link_idx[action]] = True
+            self._free += 1
+            if len(self.queue) > 0:
+                self.network.active.add(self.ID)
+
     def __repr__(self):
         return f"Node<{self.ID}, queue: {self.queue}, sent: {self.sent}>"
 
@@ -128,6 +322,8 @@ class Node:
             # enter queue and wait for being deliveried.
             packet.start_queue = self.clock
             self.queue.append(packet)
+            if self._free > 0:
+                self.network.active.add(self.ID)
             self.agent.receive(
                 self.ID, packet.dest
             )  # for some algorithms need to know a packet received.
@@ -140,38 +336,42 @@ class Node:
         logging.debug(f"{self.clock}: {self.ID} sends {p} to {action}")
         p.hops += 1
         self.sent[action] += 1
+        if self.sent[action] == self.network.bandwidth:  # it gets full
+            self._avaliable[self._link_idx[action]] = False
+            self._free -= 1
         p.trans_time = self.network.transtime  # set the transmission delay
-        heappush(self.network.event_queue,
-                 Event(p, self.ID, action, self.clock + p.trans_time))
+        self.network.event_queue.push(
+            Event(p, self.ID, action, self.clock + p.trans_time))
 
-    def _build_info_default(self, agent_info, packet, action):
+    def _build_info_default(self, info, packet, action):
         # set the environment rewards
         # q: queuing delay; t: transmission delay
-        agent_info['q_y'] = self.clock - packet.start_queue
-        agent_info['t_y'] = 1
-        return agent_info
+        info['q_y'].append(self.clock - packet.start_queue)
+        info['t_y'].append(1)
 
-    def _build_info_dual(self, agent_info, packet, action):
+    def _build_info_dual(self, info, packet, action):
         # dual mode
-        agent_info['q_y'] = max(1, len(self.network.nodes[action].queue))
-        agent_info['t_y'] = 0
-        agent_info['q_x'] = max(1, len(self.queue))
-        agent_info['t_x'] = 0
-        return agent_info
+        info['q_y'].append(max(1, len(self.network.nodes[action].queue)))
+        info['t_y'].append(0)
+        info['q_x'].append(max(1, len(self.queue)))
+        info['t_x'].append(0)
+
+    def send(self, rewards):
+        """ Send packets from the queue, following the mode
 
-    def _send_default(self):
+        Args:
+            rewards (RewardBatch): where to append the Rewards of sent packets, None in 'frozen' mode.
+        """
+        self._send(rewards)
+        self._update_active()
+
+    def _send_default(self, rewards):
         """ Send a packet in queue order.
         agent.choose determines the action/next node
-
-        Returns:
-            List[Reward]
         """
         i = 0
-        rewards = []
-        avaliable_path = np.array(  # some condition to check path avaliable
-            [self.is_avaliable(i) for i in self.links],
-            dtype=bool)
-        while i < len(self.queue) and any(avaliable_path):
+        avaliable_path = self._avaliable  # some condition to check path avaliable
+        while i < len(self.queue) and self._free > 0:
             dest = self.queue[i].dest
             # if the connection to chosen `action` is full, skip the packet and send the next packet in queue
             action = self.agent.choose(self.ID, dest)
@@ -179,35 +379,41 @@ class Node:
                 p = self.queue.pop(i)
                 self._send_packet(p, action)
                 self.agent.send(self.ID, dest)
-                avaliable_path[self.agent.action_idx[self.ID][action]] = self.is_avaliable(action)
-                # then build Reward
-                agent_info = self.agent.get_info(self.ID, action, p)
-                agent_info = self._build_info(agent_info, p, action)
-                rewards.append(Reward(self.ID, p, action, agent_info))
+                # then build Reward, `agent.get_info_batch` completes it after all nodes sent
+                rewards.append(self.ID, p, action)
+                self._build_info(rewards.info, p, action)
                 # Remove/comment the next line if Multiple Packages Need to be Sent at once
-                return rewards # only one packet can be sent
+                return # only one packet can be sent
             else:
                 i += 1
-        return rewards
 
-    def _send_bp(self):
+    def _send_frozen(self, rewards):
+        """ Send a packet in queue order as `_send_default` does, the next hops read from a FrozenPolicy,
+        without Rewards (`rewards` is None) or telling the agent
+        """
         i = 0
-        rewards = []
-        avaliable_path = [n for n in self.links if self.is_avaliable(n)]
+        choose_idx = self.agent.choose_idx
+        while i < len(self.queue) and self._free > 0:
+            y_idx = choose_idx(self.ID, self.queue[i].dest)
+            if self._avaliable[y_idx]:
+                self._send_packet(self.queue.pop(i), self.links[y_idx])
+                return  # only one packet can be sent
+            i += 1
+
+    def _send_bp(self, rewards):
+        avaliable_path = [y for y, a in zip(self.links, self._avaliable) if a]
         while len(avaliable_path) > 0 and len(self.queue) > 0:
             dests = self.agent.choose(self.ID, avaliable_path)
-            if not any(dests):
+            if all(dest is None for dest in dests):  # destination 0 is falsy
                 break
             for dest, action in zip(dests, avaliable_path):
                 if dest is None:
                     continue
-                p = next(p for p in self.queue if p.dest == dest)
-                self.queue.remove(p)
+                p = self.queue.pop(dest)
                 self._send_packet(p, action)
                 self.agent.send(self.ID, dest)
-                rewards.append(Reward(self.ID, p, action, {}))
-            avaliable_path = [n for n in self.links if self.is_avaliable(n)]
-        return rewards
+                rewards.append(self.ID, p, action)
+            avaliable_path = [y for y, a in zip(self.links, self._avaliable) if a]
 
 
 class Network:
@@ -218,15 +424,26 @@ class Network:
         bandwidth (int): the bandwidth limitation of a connection/the maximum number of transmitting packets simultaneously
         transtime (int, float): the time delay of transmitting a packet to next node
         is_drop (bool): whether the network drop packet on some condition (the packet hops overpass number of all nodes)
+        seed (int | np.random.SeedSequence): [optional] the root seed of all random streams in this simulation,
+            drawn from the global `np.random` state if not given, so `np.random.seed` still fixes a run.
 
     Attributes:
         clock (int): The simulation time.
         nodes (Dict[Int, Node]): An ordered dictionary of all nodes in this network.
         links (Dict[Int, List[Int]]): lists of connected nodes' ID.
+        coords (np.array((nodes, 2))): the coordinates of nodes in the network file, nan if not given.
+        traffic (Traffic): draws the new packets, uniform between all pairs of nodes by default.
+        seed_sequence (np.random.SeedSequence): spawns an independent random stream for each component,
+            the traffic and every agent, in the order they are created.
         agent (Policy): bind an agent, which follows class `Policy`
         mode (string): Network mode,
-            None -> Default mode, 'dual' -> Duality, 'bp' -> BackPressure
-        event_queue (heap): A queue of following happen events.
+            None -> Default mode, 'dual' -> Duality, 'bp' -> BackPressure, 'frozen' -> FrozenPolicy
+        event_queue (EventQueue): A queue of following happen events.
+        active (Set[int]): the nodes having packets in queue and avaliable connections,
+            the only ones `step` lets send.
+        profiler (PhaseProfiler | None): the time and counts of the phases of steps, while `profile` is on.
+        queue_count (np.array((nodes, nodes))): [only in 'bp' mode] `queue_count[x, d]` is the
+            number of packets to `d` queued in node `x`.
         all_packets (int): The total number of packets in this simulation.
         end_packets (int): The packets already ends in its destination.
         drop_packets (int): The number of dropped packets
@@ -234,17 +451,24 @@ class Network:
         hops (int): The number of total hops of all packets
         route_time (int): The total routing time of all ended packets.
     """
-    def __init__(self, file, bandwidth=1, transtime=1, is_drop=False):
+    def __init__(self, file, bandwidth=1, transtime=1, is_drop=False, seed=None):
+        if seed is None:
+            seed = np.random.randint(0, 2**32, size=4)
+        self.seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
         self.bandwidth = bandwidth
         self.transtime = transtime
         self.nodes = OrderedDict()
         self.links = OrderedDict()
         self.is_drop = is_drop
         self.sample, self._sample_idx = [], 0
+        self.queue_count = None
+        self.active = set()
+        self.profiler = None
 
         self.read_network(file)
         for i in self.links.keys():
             self.nodes[i] = Node(i, self)
+        self.traffic = UniformTraffic(self)
 
         self._agent = Policy(self)
         self.reset()
@@ -260,56 +484,103 @@ class Network:
     @agent.setter
     def agent(self, new_agent):
         if self.mode != new_agent.mode:
+            self.queue_count = self._new_queue_count(new_agent.mode)
             for node in self.nodes.values():
                 node.set_mode(new_agent.mode)
         self._agent = new_agent
 
+    def profile(self, enable=True):
+        """ start (or stop) profiling the phases of steps (see PhaseProfiler), with the agent bound now.
+        While profiling, `train` returns the profile so far too.
+
+        Returns:
+            PhaseProfiler | None: `profiler`, accumulating from now on.
+        """
+        if enable and self.profiler is None:
+            self.profiler = PhaseProfiler(self)
+        elif not enable and self.profiler is not None:
+            self.profiler.detach()
+            self.profiler = None
+        return self.profiler
+
+    def spawn_rng(self):
+        " a random Generator independent of all others spawned, for a component of this simulation "
+        return np.random.default_rng(self.seed_sequence.spawn(1)[0])
+
     def reset(self):
         """ reset the network attributes """
         self.clock = 0
-        self.event_queue = []
+        self.event_queue = EventQueue()
         self.all_packets = 0
         self.end_packets = 0
         self.drop_packets = 0
         self.active_packets = 0
         self.hops = 0
         self.route_time = 0
+        self.queue_count = self._new_queue_count(self.mode)
         for node in self.nodes.values():
             node.reset()
         self.agent.clean()  # tell agent the Network resetted
         # NOT reset the agent
 
+    def _new_queue_count(self, mode):
+        if mode == 'bp':
+            return np.zeros((len(self.links), len(self.links)), dtype=int)
+        return None
+
     def read_network(self, file):
         " read_network constructs the Network.links "
         self.proj = {}  # project from file identity to node ID
         with open(file, 'r') as f:
             lines = [l.split() for l in f.readlines()]
         ID = 0
+        coords = []
         for l in lines:
             if l[0] == "1000":  # declare a node
                 self.proj[l[1]] = ID
                 self.links[ID] = []
+                coords.append([float(c) for c in l[2:4]] if len(l) >= 4 else [np.nan] * 2)
                 ID += 1  # increase ID
             elif l[0] == "2000":  # delcare a connection
                 src, dst = self.proj[l[1]], self.proj[l[2]]
                 self.links[src].append(dst)
                 self.links[dst].append(src)
+        self.coords = np.array(coords, dtype=np.float64).reshape(-1, 2)
 
     def new_packet(self, lambd):
-        """ Generates new packets following Poisson(lambd).
+        """ Generates new packets following Poisson(lambd), between nodes drawn by `traffic`.
         Args:
             lambd (int, float): The Poisson distribution parameter.
         Returns:
             list: new packets having random sources and destinations.
         """
-        packets = []
-        nodes_num = len(self.nodes)
-        for _ in range(np.random.poisson(lambd)):
-            source, dest = np.random.randint(0, nodes_num, size=2)
-            while dest == source:  # assert: source != dest
-                dest = np.random.randint(0, nodes_num)
-            packets.append(Packet(source, dest, self.clock))
-        return packets
+        return self._packets(*self.traffic.arrival(lambd, self.clock))
+
+    def _packets(self, sources, dests):
+        return [Packet(s, d, self.clock) for s, d in zip(sources.tolist(), dests.tolist())]
+
+    def _arrivals(self, lambd, slot, freq, chunk=1000, slots=None):
+        """ new packets of the coming time slots, drawn by `traffic` `chunk` slots at a time,
+        up to `slots` slots if given. Closing it hands the slots drawn but not taken back
+        (`traffic.unread`, with 0 if all were), so a trace records and replays only the slots injected.
+
+        Returns:
+            Iterator[Tuple[np.array(Int), np.array(Int)]]: the sources and destinations of packets in each slot.
+        """
+        left = 0  # the slots drawn not taken yet
+        try:
+            while slots is None or slots > 0:
+                size = chunk if slots is None else min(chunk, slots)
+                clocks = self.clock + slot * freq * np.arange(size)  # `freq` steps of `slot` in a slot
+                drawn = self.traffic.arrivals(lambd * slot, clocks)
+                left = len(drawn)
+                if slots is not None:
+                    slots -= size
+                for arrival in drawn:
+                    left -= 1
+                    yield arrival
+        finally:
+            self.traffic.unread(left)
 
     def inject(self, packets):
         """ Injects the packets into network """
@@ -330,6 +601,20 @@ class Network:
         self.hops += packet.hops
         del packet
 
+    def _send_all(self):
+        """ the active nodes send in the order of `nodes`, returning the rewards completed by the agent,
+        None in 'frozen' mode """
+        if self.mode == 'frozen':
+            for ID in sorted(self.active):
+                self.nodes[ID].send(None)
+            return None
+        rewards = RewardBatch()
+        for ID in sorted(self.active):
+            self.nodes[ID].send(rewards)
+        # the agent tables do not change while sending, so its info is read for all rewards at once
+        rewards.info.update(self.agent.get_info_batch(rewards))
+        return rewards
+
     def step(self, duration):
         """ step runs the network forward `duration`
         one sending and one agent learning
@@ -338,20 +623,16 @@ class Network:
             duration (int, duration): The duration of one step.
 
         Returns:
-            List[Reward]: A list of rewards from sending events happended in the timeslot.
+            RewardBatch: the rewards from sending events happended in the timeslot, None in 'frozen' mode.
         """
-        rewards = []
-        for node in self.nodes.values():
-            r = node.send()  # r: List[Reward]
-            if r:  # len(r) > 0
-                rewards += r
-
-        end_time = self.clock + duration
-        next_event = nsmallest(1, self.event_queue)
-        while len(next_event) > 0 and next_event[0].arrive_time <= end_time:
-            e = heappop(self.event_queue)
-            self.nodes[e.from_node].sent[e.to_node] -= 1
-            next_event = nsmallest(1, self.event_queue)
+        rewards = self._send_all()
+        self._deliver(self.clock + duration)
+        return rewards
+
+    def _deliver(self, end_time):
+        " deliver the Events arriving until `end_time`, then move the clock to it "
+        for e in self.event_queue.pop_until(end_time):
+            self.nodes[e.from_node].release(e.to_node)
             if self.is_drop and e.packet.hops >= len(self.nodes):
                 # drop the packet if too many hops
                 self.drop_packets += 1
@@ -362,7 +643,6 @@ class Network:
             self.nodes[e.to_node].receive(e.packet)
 
         self.clock = end_time
-        return rewards
 
     def train(self,
               duration,
@@ -371,7 +651,8 @@ class Network:
               freq=1,
               lr={},
               droprate=False,
-              hop=False):
+              hop=False,
+              memory=False):
         """ train process the whole network forward
         new packet arriving at `lambd` (s^-1) rate
         call `step` to send and learn from rewards
@@ -385,11 +666,14 @@ class Network:
             penalty (float): drop penalty
             droprate (bool): whether return droprate or not
             hop (bool): whether return hop times or not
+            memory (bool): whether return the bytes of agent tables (`agent.memory()`) or not
 
         Returns:
             Result (Dict[Str, List[Real]]):
                 route_time (List[Real]): the vector of routing time in this training duration.
                 drop_rate (List[Real]): the vector of packet-drop rate in this train.
+                memory (List[Real]): the vector of the bytes of agent tables after each slot.
+                profile (Dict): [while profiling] `profiler.as_dict()` at the end.
         """
         step_num = int(duration / slot)
         result = {'route_time': np.zeros(step_num)}
@@ -397,20 +681,30 @@ class Network:
             result['droprate'] = np.zeros(step_num)
         if hop:
             result['hop'] = np.zeros(step_num)
-        for i in range(step_num):
-            self.inject(self.new_packet(lambd * slot))
-            for _ in range(freq):
-                r = self.step(slot)
-                if r is not None:
-                    if lr:
-                        self.agent.learn(r, lr=lr)
-                    else:
-                        self.agent.learn(r)
-            result['route_time'][i] = self.ave_route_time
-            if droprate:
-                result['droprate'][i] = self.drop_rate
-            if hop:
-                result['hop'][i] = self.ave_hops
+        if memory:
+            result['memory'] = np.zeros(step_num)
+        arrivals = self._arrivals(lambd, slot, freq, slots=step_num)
+        try:
+            for i in range(step_num):
+                self.inject(self._packets(*next(arrivals)))
+                for _ in range(freq):
+                    r = self.step(slot)
+                    if r is not None:
+                        if lr:
+                            self.agent.learn(r, lr=lr)
+                        else:
+                            self.agent.learn(r)
+                result['route_time'][i] = self.ave_route_time
+                if droprate:
+                    result['droprate'][i] = self.drop_rate
+                if hop:
+                    result['hop'][i] = self.ave_hops
+                if memory:
+                    result['memory'][i] = sum(self.agent.memory().values())
+        finally:
+            arrivals.close()
+        if self.profiler is not None:
+            result['profile'] = self.profiler.as_dict()
         return result
 
     def sample_route_time(self, size, lambd, slot=1, freq=1, lr={}):
@@ -420,19 +714,24 @@ class Network:
         Due to different "load setting", the numbers of arrived packages in a same duration can be different.
         `sample_route_time` runs the network as `train` does, however stops when the number of arrived packages reaches `size`.
         Or say, it returns a `size`-long array, which records 'routing_time' of arrived packages.
+        While profiling, read the profile from `profiler` after.
         """
         self.sample = np.zeros(size)
         self._sample_idx = 0
-        while self._sample_idx < size:
-            self.inject(self.new_packet(lambd * slot))
-            for _ in range(freq):
-                r = self.step(slot)
-                if r is None:
-                    continue
-                if lr:
-                    self.agent.learn(r, lr=lr)
-                else:
-                    self.agent.learn(r)
+        arrivals = self._arrivals(lambd, slot, freq)
+        try:
+            while self._sample_idx < size:
+                self.inject(self._packets(*next(arrivals)))
+                for _ in range(freq):
+                    r = self.step(slot)
+                    if r is None:
+                        continue
+                    if lr:
+                        self.agent.learn(r, lr=lr)
+                    else:
+                        self.agent.learn(r)
+        finally:
+            arrivals.close()
         sample = self.sample
         self.sample = []
         return sample
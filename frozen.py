@@ -0,0 +1,77 @@
+import numpy as np
+
+from base_policy import Policy
+from table import Table
+from qroute import Qroute
+from hybrid import PolicyGradient
+
+
+class FrozenPolicy(Policy):
+    """ FrozenPolicy routes as a trained agent does, from tables compiled from it once, and learns nothing:
+    - the greedy next hop of every (node, destination) for Q-routing agents (CQ and CDRQ too),
+    - the cumulative distributions of the choices for PolicyGradient agents (HybridQ, ...),
+      which draw from them as `PolicyGradient.choose` does,
+    - the choices `choose_many` makes now for other agents, which must choose deterministically (e.g. Shortest).
+
+    It runs the Network in 'frozen' mode, where nodes send without building Rewards and `step` returns None,
+    so no `get_info` or `learn` runs, and `train` and `sample_route_time` evaluate the agent.
+
+    Args:
+        network (Network): where it routes.
+        agent (Policy): the trained agent, left unchanged. The rows of a sparse table not used yet
+            are compiled from the values its `init` gives them now. BackPressure and `random` agents,
+            whose choices depend on the queues or on draws, cannot be frozen.
+
+    Attributes:
+        stochastic (bool): whether choices are drawn from `cdf`, or read from `hop`.
+        hop (np.array(UInt, (nodes, nodes))): hop[x, d] is the index in `links[x]` of the next hop from x to d,
+            in the smallest unsigned type holding the degrees.
+        cdf (Table): cdf[x][d] is the cumulative distribution of the choice at x of packets to d.
+        rng (np.random.Generator): draws the stochastic choices; a copy of the agent's draws the choices it would.
+    """
+    mode = 'frozen'
+
+    def __init__(self, network, agent):
+        # 'dual' mode (CDRQ) only changes what the agent learns from, not how it chooses
+        if agent.mode == 'bp' or getattr(agent, 'random', False):
+            raise TypeError(f"{type(agent).__name__} cannot be frozen, its choices depend on more than a table")
+        super().__init__(network)
+        self.agent_type = type(agent).__name__
+        self.stochastic = isinstance(agent, PolicyGradient)
+        n = len(self.links)
+        if self.stochastic:
+            self.cdf = Table(self.links, dtype=agent.Theta.data.dtype)
+            for x, cdf in self.cdf.items():
+                # as `_cdf_row` computes it, all rows of x at once
+                e_theta = np.exp(agent.Theta.peek(np.full(n, x), np.arange(n)))
+                np.cumsum(e_theta / e_theta.sum(axis=1, keepdims=True), axis=1, out=cdf)
+                cdf /= cdf[:, -1:]
+            return
+        self.hop = np.zeros((n, n), dtype=np.min_scalar_type(max(len(y) for y in self.links.values()) - 1))
+        for x in range(n):
+            if isinstance(agent, Qroute):
+                self.hop[x] = agent.Qtable.peek(np.full(n, x), np.arange(n), -np.inf).argmax(axis=1)
+            else:
+                index = np.zeros(n, dtype=int)
+                index[self.links[x]] = np.arange(len(self.links[x]))
+                dests = np.flatnonzero(np.arange(n) != x)  # packets never wait at their destination
+                self.hop[x, dests] = index[np.asarray(agent.choose_many(x, dests), dtype=int)]
+
+    def __repr__(self):
+        return f"<FrozenPolicy of {self.agent_type}, {'stochastic' if self.stochastic else 'greedy'}>"
+
+    def choose_idx(self, source, dest):
+        " the index in `links[source]` of the next hop "
+        if self.stochastic:
+            return self.cdf[source][dest].searchsorted(self.rng.random(), side='right')
+        return self.hop[source, dest]
+
+    def choose(self, source, dest):
+        return self.links[source][self.choose_idx(source, dest)]
+
+    def choose_many(self, source, dests):
+        dests = np.asarray(dests, dtype=int)
+        if not self.stochastic:
+            return self.links[source][self.hop[source, dests]]
+        cdf = self.cdf.rows(np.full(len(dests), source), dests, np.inf)
+        return self.links[source][(cdf <= self.rng.random(len(dests))[:, None]).sum(axis=1)]
@@ -4,23 +4,56 @@ from qroute import *
 
 
 class PolicyGradient(Policy):
+    """
+    Attributes:
+        _cdf (Table): _cdf[x][d] is the cumulative distribution of `_softmax(x, d)`,
+            valid where `_cdf_valid[x, d]`, which every update of Theta[x][d] clears.
+    """
     attrs = Policy.attrs | set(['Theta', 'discount'])
 
-    def __init__(self, network, initP=0, add_entropy=False, discount=0.9):
+    def __init__(self, network, initP=0, add_entropy=False, discount=0.9, sparse=False, dtype=np.float64):
+        self.sparse = sparse  # before the tables of Qroute, if mixed in, are built by `super().__init__`
         super().__init__(network)
         self.add_entropy = add_entropy
         self.discount = discount
-        self.Theta = {x: np.full((len(self.links), len(ys)), initP, dtype=np.float64)
-                      for x, ys in self.links.items()}
+        self.Theta = (SparseTable if sparse else Table)(self.links, initP, dtype=dtype)
+        self._cdf = self.Theta.like()
+        self._cdf_valid = self.Theta.row_cache(bool, False)
+
+    def _refresh(self):
+        super()._refresh()
+        self._cdf = self.Theta.like()
+        self._cdf_valid = self.Theta.row_cache(bool, False)
 
     def _softmax(self, source, dest):
         e_theta = np.exp(self.Theta[source][dest])
         return e_theta/e_theta.sum()
 
+    def _cdf_row(self, source, dest):
+        " the cumulative distribution of choices, the same as `rng.choice` builds from `_softmax` "
+        cdf = self._cdf[source][dest]
+        if not self._cdf_valid[source, dest]:
+            np.cumsum(self._softmax(source, dest), out=cdf)
+            cdf /= cdf[-1]
+            self._cdf_valid[source, dest] = True
+        return cdf
+
     def choose(self, source, dest, prob=None):
         """ choose returns the choice following weighted random sample """
-        return np.random.choice(self.links[source], p=(
-            self._softmax(source, dest) if prob is None else prob))
+        if prob is not None:
+            return self.rng.choice(self.links[source], p=prob)
+        # draws as `self.rng.choice(self.links[source], p=self._softmax(source, dest))` does
+        cdf = self._cdf_row(source, dest)
+        return self.links[source][cdf.searchsorted(self.rng.random(), side='right')]
+
+    def choose_many(self, source, dests):
+        """ the choices to all `dests`, drawn as calling `choose` on each of them in order """
+        dests = np.asarray(dests, dtype=int)
+        for dest in dests[~self._cdf_valid[source, dests]]:
+            self._cdf_row(source, dest)
+        cdf = self._cdf.rows(np.full(len(dests), source), dests, np.inf)
+        uniform = self.rng.random(len(dests))
+        return self.links[source][(cdf <= uniform[:, None]).sum(axis=1)]
 
     def _gradient(self, source, dest, action_idx, softmax=None):
         """ gradient returns a vector with length of neighbors of source """
@@ -33,23 +66,31 @@ class PolicyGradient(Policy):
         gradient = self._gradient(
             x, dest, self.action_idx[x][y], softmax=softmax)
         self.Theta[x][dest] += lrp * gradient * \
-            (r + self.discount * max_Q_y - max_Q_x_d)
+            (r + self.discount * float(max_Q_y) - float(max_Q_x_d))
+        self._cdf_valid[x, dest] = False
 
     def _update_entropy(self, r, lr, softmax):
-        return r - lr * (softmax * np.log2(softmax)).sum()
+        return r - lr * float((softmax * np.log2(softmax)).sum())
 
 class HybridQ(PolicyGradient, Qroute):
     attrs = Qroute.attrs | PolicyGradient.attrs
 
-    def __init__(self, network, initQ=0, initP=0, add_entropy=True, discount=0.99):
+    def __init__(self, network, initQ=0, initP=0, add_entropy=True, discount=0.99, sparse=False, dtype=np.float64):
         PolicyGradient.__init__(self, network, initP,
-                                add_entropy=add_entropy, discount=discount)
-        Qroute.__init__(self, network, initQ, discount=discount)
+                                add_entropy=add_entropy, discount=discount, sparse=sparse, dtype=dtype)
+        Qroute.__init__(self, network, initQ, discount=discount, sparse=sparse, dtype=dtype)
 
     def get_info(self, source, action, packet):
         return {
-            'max_Q_y': self.Qtable[action][packet.dest].max(),
-            'max_Q_x_d': self.Qtable[source][packet.dest].max(),
+            'max_Q_y': self._best_Q[action, packet.dest],
+            'max_Q_x_d': self._best_Q[source, packet.dest],
+        }
+
+    def get_info_batch(self, rewards):
+        dest = rewards.column('dest')
+        return {
+            'max_Q_y': self._best_Q[rewards.column('action'), dest],
+            'max_Q_x_d': self._best_Q[rewards.column('source'), dest],
         }
 
     def _update(self, reward, lr={'q': 0.1, 'p': 0.1, 'e': 0.1}):
@@ -65,18 +106,27 @@ class HybridQ(PolicyGradient, Qroute):
 class HybridCQ(PolicyGradient, CQ):
     attrs = CQ.attrs | PolicyGradient.attrs
 
-    def __init__(self, network, initQ=0, initP=0, decay=0.9, add_entropy=False, discount=0.99):
+    def __init__(self, network, initQ=0, initP=0, decay=0.9, add_entropy=False, discount=0.99, sparse=False,
+                 dtype=np.float64):
         PolicyGradient.__init__(self, network, initP,
-                                add_entropy=add_entropy, discount=discount)
+                                add_entropy=add_entropy, discount=discount, sparse=sparse, dtype=dtype)
         CQ.__init__(self, network, decay=decay,
-                      initQ=initQ, discount=discount)
+                      initQ=initQ, discount=discount, sparse=sparse, dtype=dtype)
 
     def get_info(self, source, action, packet):
-        z_f, max_Q_f = Qroute.choose(self, action, packet.dest, score=True)
+        z_f, max_Q_f = Qroute.choose(self, action, packet.dest, idx=True)
         return {
             'max_Q_f': max_Q_f,
-            'C_f': self.confidence[action][packet.dest][z_f],
-            'max_Q_x_d': self.Qtable[source][packet.dest].max(),
+            'C_f': self._conf(action, packet.dest, z_f),
+            'max_Q_x_d': self._best_Q[source, packet.dest],
+        }
+
+    def get_info_batch(self, rewards):
+        source, action, dest = rewards.column('source'), rewards.column('action'), rewards.column('dest')
+        return {
+            'max_Q_f': self._best_Q[action, dest],
+            'C_f': self._conf_batch(action, dest, self._best[action, dest]),
+            'max_Q_x_d': self._best_Q[source, dest],
         }
 
     def _update(self, reward, lr={'p': 0.1, 'e': 0.1}):
@@ -92,24 +142,31 @@ class HybridCQ(PolicyGradient, CQ):
 class HybridCDRQ(PolicyGradient, CDRQ):
     attrs = CDRQ.attrs | PolicyGradient.attrs
 
-    def __init__(self, network, add_entropy=False, initQ=0, initP=0, decay=0.9, discount=0.99):
+    def __init__(self, network, add_entropy=False, initQ=0, initP=0, decay=0.9, discount=0.99, sparse=False,
+                 dtype=np.float64):
         PolicyGradient.__init__(self, network, initP,
-                                add_entropy=add_entropy, discount=discount)
+                                add_entropy=add_entropy, discount=discount, sparse=sparse, dtype=dtype)
         CDRQ.__init__(self, network, decay=decay,
-                      initQ=initQ, discount=discount)
+                      initQ=initQ, discount=discount, sparse=sparse, dtype=dtype)
 
     def get_info(self, source, action, packet):
-        w_idx, max_Q_b = Qroute.choose(self, source, packet.source, score=True)
-        z_idx, max_Q_f = Qroute.choose(self, action, packet.dest, score=True)
+        w_idx, max_Q_b = Qroute.choose(self, source, packet.source, idx=True)
+        z_idx, max_Q_f = Qroute.choose(self, action, packet.dest, idx=True)
         return {
             'max_Q_b': max_Q_b,
             'max_Q_f': max_Q_f,
-            'C_b': self.confidence[source][packet.source][w_idx],
-            'C_f': self.confidence[action][packet.dest][z_idx],
-            'max_Q_x_d': self.Qtable[source][packet.dest].max(),
-            'max_Q_y_s': self.Qtable[action][packet.source].max(),
+            'C_b': self._conf(source, packet.source, w_idx),
+            'C_f': self._conf(action, packet.dest, z_idx),
+            'max_Q_x_d': self._best_Q[source, packet.dest],
+            'max_Q_y_s': self._best_Q[action, packet.source],
         }
 
+    def get_info_batch(self, rewards):
+        info = CDRQ.get_info_batch(self, rewards)
+        info['max_Q_x_d'] = self._best_Q[rewards.column('source'), rewards.column('dest')]
+        info['max_Q_y_s'] = self._best_Q[rewards.column('action'), rewards.column('packet_source')]
+        return info
+
     def _update(self, reward, lr={'f': 0.85, 'b': 0.95, 'p': 0.1, 'e': 0.1}):
         r_f, info, x, y, dst = self._extract(reward)
         src = reward.packet.source
@@ -1,50 +1,74 @@
 import numpy as np
 
 from hybrid import *
+from table import Table, SparseTrace
 
 
 class MaHybridQ(HybridQ):
-    """ Multi-agent Hybrid Q routing with Eligibility Traces """
+    """ Multi-agent Hybrid Q routing with Eligibility Traces
+
+    The trace of Theta only keeps entries larger than `trace_epsilon`,
+    so a step updates the rows of Theta recently learned from instead of the whole table.
+    """
     attrs = HybridQ.attrs | set(['discount_trace', 'Trace'])
 
-    def __init__(self, network, initQ=0, initP=0, discount=0.99, discount_trace=0.6):
-        super().__init__(network, initQ=initQ, initP=initP, discount=discount)
+    def __init__(self, network, initQ=0, initP=0, discount=0.99, discount_trace=0.6, trace_epsilon=1e-6,
+                 sparse=False, dtype=np.float64):
+        super().__init__(network, initQ=initQ, initP=initP, discount=discount, sparse=sparse, dtype=dtype)
         self.discount_trace = discount_trace
         self.reward_shape = 0
-        self.Trace = {k: np.zeros_like(v, dtype=np.float64)
-                      for k, v in self.Theta.items()}
+        self.trace_epsilon = trace_epsilon
+        self.Trace = SparseTrace(trace_epsilon, dtype=dtype)
 
     def learn(self, rewards, lr={'q': 0.1, 'p': 0.1}):
         r_len = len(rewards)
-        x, dest, y_idx = np.zeros(r_len, dtype=np.int), np.zeros(
-            r_len, dtype=np.int), np.zeros(r_len, dtype=np.int)
-        r, max_Q_y, max_Q_x_d = np.zeros(r_len), np.zeros(r_len), np.zeros(r_len)
-        for i, reward in enumerate(rewards):
-            r[i], info, x[i], y, dest[i] = self._extract(reward)
-            y_idx[i] = self.action_idx[x[i]][y]
-            max_Q_y[i] = info['max_Q_y']
-            max_Q_x_d[i] = info['max_Q_x_d']
+        r, x, y, dest, info = self._extract_batch(rewards, ['max_Q_y', 'max_Q_x_d'])
+        y_idx = self._action_index(x, y)
+        max_Q_y, max_Q_x_d = info['max_Q_y'], info['max_Q_x_d']
 
         delta = r.sum() + self.reward_shape + self.discount * \
             max_Q_y.sum() - max_Q_x_d.sum()
         self.reward_shape = 0
         # update Eligibility Trace
-        for trace in self.Trace.values():
-            trace *= self.discount_trace
+        self.Trace.decay(self.discount_trace)
+        gradient = []
         for i in range(r_len):
-            self.Trace[x[i]][dest[i]] += \
-                self._gradient(x[i], dest[i], y_idx[i])
+            gradient.append(self._gradient(x[i], dest[i], y_idx[i]))
             # update Q table
-            old_Q_score = self.Qtable[x[i]][dest[i]][y_idx[i]]
-            self.Qtable[x[i]][dest[i]][y_idx[i]] += lr['q'] * \
-                (r[i] + self.discount*max_Q_y[i] - old_Q_score)
+            row = self.Qtable[x[i]][dest[i]]
+            old_Q_score = float(row[y_idx[i]])
+            row[y_idx[i]] = old_Q_score + lr['q'] * \
+                (r[i] + self.discount*float(max_Q_y[i]) - old_Q_score)
+            self._touch(x[i], dest[i])
+        if r_len > 0:
+            self.Trace.add(self.Theta.row_index(x, dest), np.concatenate(gradient))
         # Update Theta
-        for x, theta in self.Theta.items():
-            theta += lr['p'] * delta * self.Trace[x]
+        changed = self.Trace.apply(self.Theta.data, lr['p'] * delta)
+        x, dest, _ = self.Theta.locate(changed)
+        self._cdf_valid[x, dest] = False
 
     def __repr__(self):
         return "<MultiAgent discount:{} discount_trace:{}>".format(self.discount, self.discount_trace)
 
+    def _refresh(self):
+        super()._refresh()
+        if not isinstance(self.Trace, SparseTrace):
+            self.Trace = self._sparse_trace(self.Trace)
+
+    def _sparse_trace(self, trace):
+        """ the SparseTrace of a trace stored before it was sparse:
+        a Table, or a `{node: np.array}` dictionary, of the values of all entries of Theta """
+        if isinstance(trace, dict):
+            trace = Table.from_dict(self.links, trace)
+        if type(trace) is not Table or len(trace) != len(self.links):
+            raise ValueError(f"cannot load a Trace of {type(trace).__name__}, "
+                             f"only a SparseTrace or a Table of the entries of Theta")
+        sparse = SparseTrace(self.trace_epsilon, dtype=self.Theta.data.dtype)
+        index = np.flatnonzero(trace.data)
+        if len(index) > 0:
+            # the same entries in Theta, which a SparseTable lays out in the order rows are used
+            sparse.add(self.Theta.index(*trace.locate(index)), trace.data[index].astype(sparse.dtype))
+        return sparse
+
     def clean(self):
-        for trace in self.Trace.values():
-            trace.fill(0.0)
+        self.Trace.clear()
@@ -0,0 +1,328 @@
+import copy
+import traceback
+import numpy as np
+import multiprocessing as mp
+from collections import deque
+
+from env import Network, Event
+from table import Table
+from qroute import Qroute, CQ
+from shortest import Shortest
+
+# the policies whose decisions at a node read only the node's own rows and the rows of its neighbors
+# that `get_info` reads, which the workers exchange
+SUPPORTED = (Qroute, CQ, Shortest)
+# the greedy caches indexed [x, d], exchanged with the tables
+_CACHES = ('_best', '_best_Q')
+
+
+def partition(links, parts):
+    """ splits the nodes into `parts` blocks of (almost) equal size cutting few links:
+    the nodes are numbered in breadth-first order, which is cut into `parts` runs.
+
+    Returns:
+        np.array(Int): the part of each node.
+    """
+    n = len(links)
+    seen = np.zeros(n, dtype=bool)
+    order = []
+    for root in range(n):
+        if seen[root]:
+            continue
+        seen[root] = True
+        frontier = deque([root])
+        while frontier:
+            x = frontier.popleft()
+            order.append(x)
+            for y in links[x]:
+                if not seen[y]:
+                    seen[y] = True
+                    frontier.append(y)
+    owner = np.empty(n, dtype=int)
+    owner[order] = np.arange(n) * parts // n
+    return owner
+
+
+class _Outbox:
+    " takes the place of the EventQueue of a worker, keeping the sent Events in send order "
+    def __init__(self):
+        self.events = []
+
+    def __len__(self):
+        return len(self.events)
+
+    def push(self, event):
+        self.events.append(event)
+
+    def take(self):
+        events, self.events = self.events, []
+        return events
+
+
+class _Worker:
+    """ _Worker simulates the nodes of one part on a full replica of the network and the agent.
+
+    Only the rows of its own nodes are up to date in its agent, and the rows of the
+    neighboring nodes of other parts, which it receives after every step.
+    """
+    def __init__(self, ID, owner, file, network_kwargs, policy, policy_kwargs, seed):
+        self.ID = ID
+        self.owner = owner
+        self.network = Network(file, seed=seed, **network_kwargs)
+        self.network.agent = policy(self.network, **policy_kwargs)
+        self.agent = self.network.agent
+        self.tables = sorted(k for k, v in vars(self.agent).items() if isinstance(v, Table))
+        self.caches = [k for k in _CACHES if k in vars(self.agent)]
+        # near[w][x]: whether node x of this part has a neighbor in part w
+        self.near = np.zeros((owner.max() + 1, len(owner)), dtype=bool)
+        for x, neighbors in self.network.links.items():
+            if owner[x] == ID:
+                self.near[owner[neighbors], x] = True
+        self.near[ID] = False
+        self.reset()
+
+    def reset(self):
+        self.network.reset()
+        self.network.event_queue = _Outbox()
+        self.rewards = None
+
+    def send(self, clock, packets, rows):
+        " receive the new packets and the rows of other parts, then the active nodes send "
+        for part in rows:
+            self._set_rows(part)
+        self.network.clock = clock
+        for p in packets:
+            self.network.nodes[p.source].receive(p)
+        self.rewards = self.network._send_all()
+        return [(e.packet, e.from_node, e.to_node, e.arrive_time) for e in self.network.event_queue.take()]
+
+    def deliver(self, actions, end_time, lr):
+        """ release connections and receive packets in the order given, then learn
+
+        Returns:
+            List[Dict]: the rows learned to send to each part.
+        """
+        nodes = self.network.nodes
+        for kind, x, y, arg in actions:
+            if kind == 'release':
+                nodes[x].release(y)
+            elif kind == 'receive':
+                self.network.clock = arg
+                nodes[y].receive(x)
+            else:  # 'drop'
+                self.agent.drop_penalty(arg)
+        self.network.clock = end_time
+        if lr:
+            self.agent.learn(self.rewards, lr=lr)
+        else:
+            self.agent.learn(self.rewards)
+        return [self._get_rows(self.rewards, w) for w in range(len(self.near))]
+
+    def _get_rows(self, rewards, part):
+        " the rows (x, d) learned from `rewards` that part `part` reads "
+        x, d = rewards.column('source'), rewards.column('dest')
+        near = self.near[part][x]
+        if not near.any() or not (self.tables or self.caches):
+            return None
+        n = len(self.owner)
+        x, d = np.divmod(np.unique(x[near] * n + d[near]), n)
+        rows = {'x': x, 'd': d}
+        for k in self.tables:
+            table = self.agent.__dict__[k]
+            index = table.row_index(x, d)
+            rows[k] = table.data[index]
+        for k in self.caches:
+            rows[k] = self.agent.__dict__[k][x, d]
+        return rows
+
+    def _set_rows(self, rows):
+        if rows is None:
+            return
+        x, d = rows['x'], rows['d']
+        for k in self.tables:
+            table = self.agent.__dict__[k]
+            index = table.row_index(x, d)
+            table.data[index] = rows[k]
+        for k in self.caches:
+            self.agent.__dict__[k][x, d] = rows[k]
+
+    def get_agent(self):
+        return self.agent
+
+    def tables_data(self):
+        return {k: self.agent.__dict__[k].data for k in self.tables}
+
+
+def _serve(conn, *args):
+    " the loop of a worker process: run the method named in each message and reply its result "
+    try:
+        worker = _Worker(*args)
+        conn.send(('ok', None))
+    except Exception:
+        conn.send(('error', traceback.format_exc()))
+        return
+    while True:
+        method, margs = conn.recv()
+        if method == 'close':
+            break
+        try:
+            conn.send(('ok', getattr(worker, method)(*margs)))
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+
+
+class ParallelNetwork(Network):
+    """ ParallelNetwork splits the nodes of a network between worker processes,
+    giving the same results as `Network` with the same seed.
+
+    Nodes only send at the beginning of a step and packets spend `transtime` on a connection,
+    so what a part does in a step does not depend on the others until the step ends:
+    each step, every worker sends from its nodes in parallel, and this process orders the
+    Events across the boundaries in one EventQueue, as `Network.step` does, telling each worker
+    which of its connections are released and which packets its nodes receive.
+    The workers then learn, and each sends the rows it updated to the workers of neighboring
+    parts, where `get_info` reads them in the next step.
+
+    This process keeps the traffic, the events and the statistics of the simulation,
+    so `train` and `sample_route_time` are those of `Network`.
+    Call `close` (or use it as a context manager) when done.
+
+    Args:
+        file, bandwidth, transtime, is_drop, seed: as `Network`.
+        policy (type): the Policy class of the agent, one of `SUPPORTED`, built as `policy(network, **policy_kwargs)`
+            in every worker. Its decisions draw no random numbers (e.g. Shortest without `random`).
+        workers (int): the number of parts and processes.
+        owner (np.array(Int)): [optional] the part of each node, by `partition` if not given.
+
+    Attributes:
+        owner (np.array(Int)): the part, and worker, of each node.
+    """
+    def __init__(self, file, policy, workers=2, policy_kwargs={}, owner=None,
+                 bandwidth=1, transtime=1, is_drop=False, seed=None):
+        if policy not in SUPPORTED or policy.mode is not None or policy_kwargs.get('random'):
+            raise TypeError(f"{policy.__name__} is not supported in parallel, only {[p.__name__ for p in SUPPORTED]}")
+        if seed is None:
+            seed = np.random.randint(0, 2**32, size=4)
+        self._conns = []
+        super().__init__(file, bandwidth, transtime, is_drop, seed=copy.deepcopy(seed))
+        self.spawn_rng()  # that of the agent, so later components get the streams they get in `Network`
+        self.owner = partition(self.links, workers) if owner is None else np.asarray(owner, dtype=int)
+        self.policy = policy
+        self._lr = {}
+        network_kwargs = {'bandwidth': bandwidth, 'transtime': transtime, 'is_drop': is_drop}
+        self._processes = []
+        for ID in range(self.owner.max() + 1):
+            conn, child = mp.Pipe()
+            process = mp.Process(target=_serve, daemon=True,
+                                 args=(child, ID, self.owner, file, network_kwargs, policy, policy_kwargs, seed))
+            process.start()
+            self._conns.append(conn)
+            self._processes.append(process)
+        for conn in self._conns:
+            self._recv(conn)
+        self._reset_parts()
+
+    def __repr__(self):
+        return f"ParallelNetwork<{len(self.links)} nodes of {self.policy.__name__} in {len(self._conns)} parts>"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for conn, process in zip(self._conns, self._processes):
+            conn.send(('close', ()))
+            process.join()
+        self._conns, self._processes = [], []
+
+    @staticmethod
+    def _recv(conn):
+        try:
+            status, result = conn.recv()
+        except EOFError:
+            raise RuntimeError("a worker exited") from None
+        if status == 'error':
+            raise RuntimeError(f"a worker failed:\n{result}")
+        return result
+
+    def _call(self, method, args):
+        " run `method` in all workers with the arguments of each, returning their results "
+        for conn, a in zip(self._conns, args):
+            conn.send((method, a))
+        return [self._recv(conn) for conn in self._conns]
+
+    def _reset_parts(self):
+        self._inbox = [[] for _ in self._conns]  # the new packets of each part
+        self._rows = [[] for _ in self._conns]  # the rows each part receives
+        self._call('reset', [()] * len(self._conns))
+
+    def reset(self):
+        super().reset()
+        if self._conns:
+            self._reset_parts()
+
+    def inject(self, packets):
+        self.all_packets += len(packets)
+        self.active_packets += len(packets)
+        for packet in packets:
+            if packet.source == packet.dest:
+                self.end_packet(packet)
+            else:
+                self._inbox[self.owner[packet.source]].append(packet)
+
+    def step(self, duration):
+        """ step runs the network forward `duration` and the agent learns, as `Network.step` and `Policy.learn`
+
+        Returns:
+            None: the rewards stay in the workers.
+        """
+        sent = self._call('send', [(self.clock, packets, rows) for packets, rows in zip(self._inbox, self._rows)])
+        self._inbox = [[] for _ in self._conns]
+        # each node sent in a row, so this is the order all nodes sent in
+        sent = sorted((e for part in sent for e in part), key=lambda e: e[1])
+        for packet, x, y, arrive_time in sent:
+            self.event_queue.push(Event(packet, x, y, arrive_time))
+
+        end_time = self.clock + duration
+        actions = [[] for _ in self._conns]
+        for e in self.event_queue.pop_until(end_time):
+            part = actions[self.owner[e.from_node]]
+            part.append(('release', e.from_node, e.to_node, None))
+            if self.is_drop and e.packet.hops >= len(self.nodes):
+                self.drop_packets += 1
+                self.active_packets -= 1
+                part.append(('drop', None, None, e))
+                continue
+            self.clock = e.arrive_time
+            if e.to_node == e.packet.dest:
+                self.end_packet(e.packet)
+            else:
+                actions[self.owner[e.to_node]].append(('receive', e.packet, e.to_node, e.arrive_time))
+        self.clock = end_time
+
+        rows = self._call('deliver', [(a, end_time, self._lr) for a in actions])
+        self._rows = [[r[w] for r in rows] for w in range(len(self._conns))]
+        return None
+
+    def train(self, duration, lambd, slot=1, freq=1, lr={}, droprate=False, hop=False):
+        self._lr = lr
+        return super().train(duration, lambd, slot, freq, droprate=droprate, hop=hop)
+
+    def sample_route_time(self, size, lambd, slot=1, freq=1, lr={}):
+        self._lr = lr
+        return super().sample_route_time(size, lambd, slot, freq)
+
+    def gather_agent(self):
+        """ a copy of the agent, with the tables of every node taken from its worker """
+        parts = self._call('tables_data', [()] * len(self._conns))
+        self._conns[0].send(('get_agent', ()))
+        agent = self._recv(self._conns[0])
+        for k, table in vars(agent).items():
+            if isinstance(table, Table):
+                entry_owner = np.repeat(self.owner, np.diff(table.offsets))
+                for w, part in enumerate(parts):
+                    table.data[entry_owner == w] = part[k][entry_owner == w]
+        agent._refresh()
+        return agent
@@ -0,0 +1,132 @@
+import csv
+import time
+
+
+class PhaseProfiler:
+    """ PhaseProfiler accumulates the wall time and the calls of each phase of a Network's steps,
+    and counts what happens in them.
+
+    It times by wrapping the methods of the network, its nodes and its agent in instance attributes,
+    removed by `detach`, so a network not profiled runs its methods untouched.
+    The agent can be stored, pickled or copied while profiled, without the wrappers.
+    Bind the agent before attaching: an agent bound later is not profiled.
+
+    Phases (nested ones are included in the outer ones):
+        step: Network.step, 'send', 'get_info' and 'events'.
+        send: Node.send of every node sending, including 'choose'.
+        choose: the agent's `choose` (`choose_idx` of a FrozenPolicy).
+        get_info: the agent's `get_info_batch`.
+        events: delivering the Events of a step, including 'receive' of arriving packets.
+        receive: Node.receive, of injected packets too.
+        learn: the agent's `learn`.
+
+    Counters:
+        sent, events, dropped, ended: the packets sent, the Events delivered, the packets dropped and ended in steps.
+
+    Args:
+        network (Network): the network to profile, attached at once.
+    """
+    phases = ('step', 'send', 'choose', 'get_info', 'events', 'receive', 'learn')
+    counters = ('sent', 'events', 'dropped', 'ended')
+
+    def __init__(self, network):
+        self.network = network
+        self._installed = []  # (object, name, the instance attribute it had, if any)
+        self.reset()
+        self.attach()
+
+    def __repr__(self):
+        return f"<PhaseProfiler {self.steps} steps, {'attached' if self._installed else 'detached'}>"
+
+    def reset(self):
+        " forget the time and counts so far "
+        self.steps = 0
+        self.time = {k: [0.0, 0] for k in self.phases}  # phase -> [seconds, calls]
+        self.count = dict.fromkeys(self.counters, 0)
+
+    def _install(self, obj, name, wrapper):
+        self._installed.append((obj, name, obj.__dict__.get(name)))
+        # marks it a wrapper, which `Policy.__getstate__` leaves out of pickles and copies
+        wrapper.__wrapped__ = getattr(obj, name)
+        setattr(obj, name, wrapper)
+
+    def _timed(self, phase, func):
+        " `func` adding its time and calls to `phase` "
+        total, clock = self.time[phase], time.perf_counter
+
+        def timed(*args, **kwargs):
+            start = clock()
+            result = func(*args, **kwargs)
+            total[0] += clock() - start
+            total[1] += 1
+            return result
+        return timed
+
+    def attach(self):
+        " wrap the methods of the network, nodes and agent, if not attached yet "
+        if self._installed:
+            return
+        network, agent, count = self.network, self.network.agent, self.count
+        for name in ('choose', 'choose_idx'):
+            if hasattr(agent, name):
+                self._install(agent, name, self._timed('choose', getattr(agent, name)))
+        self._install(agent, 'get_info_batch', self._timed('get_info', agent.get_info_batch))
+        self._install(agent, 'learn', self._timed('learn', agent.learn))
+        for node in network.nodes.values():
+            send = self._timed('send', node.send)
+
+            def counted_send(rewards, send=send):
+                queued = len(network.event_queue)
+                send(rewards)
+                count['sent'] += len(network.event_queue) - queued
+            self._install(node, 'send', counted_send)
+            self._install(node, 'receive', self._timed('receive', node.receive))
+        self._install(network, '_deliver', self._timed('events', network._deliver))
+        step = self._timed('step', network.step)
+
+        def counted_step(duration):
+            queued, sent = len(network.event_queue), count['sent']
+            dropped, ended = network.drop_packets, network.end_packets
+            rewards = step(duration)
+            # every packet sent is an Event, delivered in this step or queued for a later one
+            count['events'] += queued + count['sent'] - sent - len(network.event_queue)
+            count['dropped'] += network.drop_packets - dropped
+            count['ended'] += network.end_packets - ended
+            self.steps += 1
+            return rewards
+        self._install(network, 'step', counted_step)
+
+    def detach(self):
+        " restore the methods wrapped, keeping the time and counts "
+        for obj, name, old in reversed(self._installed):
+            if old is None:
+                del obj.__dict__[name]
+            else:
+                obj.__dict__[name] = old
+        self._installed = []
+
+    def as_dict(self):
+        """ the profile so far
+
+        Returns:
+            Dict: {'steps': int,
+                   'phases': {phase: {'seconds', 'calls', 'per_step' (seconds)}},
+                   'counters': {counter: {'total', 'per_step'}}}
+        """
+        steps = max(self.steps, 1)
+        return {
+            'steps': self.steps,
+            'phases': {k: {'seconds': s, 'calls': c, 'per_step': s / steps} for k, (s, c) in self.time.items()},
+            'counters': {k: {'total': v, 'per_step': v / steps} for k, v in self.count.items()},
+        }
+
+    def to_csv(self, file):
+        " write the profile to `file`, a row per phase then per counter "
+        profile = self.as_dict()
+        with open(file, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['kind', 'name', 'total', 'calls', 'per_step'])
+            for k, v in profile['phases'].items():
+                writer.writerow(['phase', k, v['seconds'], v['calls'], v['per_step']])
+            for k, v in profile['counters'].items():
+                writer.writerow(['counter', k, v['total'], '', v['per_step']])
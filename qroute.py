@@ -1,33 +1,122 @@
 import numpy as np
 
 from base_policy import Policy
+from table import Table, SparseTable, scale_floor
+from env import RewardBatch
+
+
+def _rounds(x, d, y_idx):
+    """ Splits a batch of updates into rounds touching distinct (x, d, y_idx) entries.
+    An update only reads the entry it writes, so applying the rounds one after another
+    equals applying the updates one by one.
+
+    Returns:
+        List[np.array(Int)]: the indexes of updates in each round.
+    """
+    if len(x) == 0:
+        return []
+    key = (x * (d.max() + 1) + d) * (y_idx.max() + 1) + y_idx
+    order = np.argsort(key, kind='stable')
+    sorted_key = key[order]
+    first = np.r_[True, sorted_key[1:] != sorted_key[:-1]]
+    group_start = np.maximum.accumulate(np.where(first, np.arange(len(key)), 0))
+    rank = np.empty(len(key), dtype=int)
+    rank[order] = np.arange(len(key)) - group_start
+    return [np.flatnonzero(rank == k) for k in range(rank.max() + 1)]
 
 
 class Qroute(Policy):
+    """
+    Parameters:
+        batch (bool): whether `learn` updates from all rewards at once with array operations,
+            giving the same tables as updating from rewards one by one.
+        sparse (bool): whether tables are SparseTables, whose rows are initialized when first used,
+            drawing the initial Q-values then (so not the values a dense table of the same seed has).
+        dtype: the type of table entries, e.g. np.float32 to halve the memory of tables;
+            computations are in float64, rounded when stored.
+
+    Attributes:
+        _best (np.array(Int, (nodes, nodes))): _best[x, d] is the index of the greedy action in Qtable[x][d].
+        _best_Q (np.array(float64, (nodes, nodes))): _best_Q[x, d] is the maximum of Qtable[x][d].
+            Both follow every update of Qtable through `_touch`; RowCaches of the rows used if `sparse`.
+    """
     attrs = Policy.attrs | set(['Qtable', 'discount', 'threshold'])
 
-    def __init__(self, network, initQ=0, discount=0.99, threshold=0.1):
+    def __init__(self, network, initQ=0, discount=0.99, threshold=0.1, batch=False, sparse=False,
+                 dtype=np.float64):
         super().__init__(network)
+        self.initQ = initQ
+        self.dtype = dtype
         self.discount = discount
         self.threshold = threshold
-        self.Qtable = {x: np.random.normal(
-            initQ, 1, (len(self.links), len(ys)))
-            for x, ys in self.links.items()}
-        for x, table in self.Qtable.items():
-            # Q_x(z, x) = 0, forall z in x.neighbors
-            table[x] = 0
-            # Q_x(z, y) = -1 if z == y else 0
-            table[self.links[x]] = -np.eye(table.shape[1])
+        self.batch = batch
+        # a policy mixing Qroute in may have chosen sparse tables before (see PolicyGradient)
+        self.sparse = sparse or self.__dict__.get('sparse', False)
+        if self.sparse:
+            self.Qtable = SparseTable(self.links, dtype=dtype, init=self._init_rows, touch=self._touch_batch)
+        else:
+            self.Qtable = Table(self.links, dtype=dtype)
+            self.Qtable.data[:] = self.rng.normal(initQ, 1, self.Qtable.data.size)
+            for x, table in self.Qtable.items():
+                # Q_x(z, x) = 0, forall z in x.neighbors
+                table[x] = 0
+                # Q_x(z, y) = -1 if z == y else 0
+                table[self.links[x]] = -np.eye(table.shape[1])
+        self._best = self.Qtable.row_cache(int)
+        self._best_Q = self.Qtable.row_cache(dtype)
+        # not `_refresh`: the `_refresh` of a policy mixing Qroute in needs its own caches, not built yet
+        self._touch_all()
+
+    def _init_rows(self, x, d):
+        " the initial rows Qtable[x[i]][d[i]] of a SparseTable, by the rule of `__init__` "
+        row, y = self.Qtable.entries(x)
+        values = self.rng.normal(self.initQ, 1, len(y))
+        values[(x == d)[row]] = 0
+        hit = y == d[row]
+        to_neighbor = np.bincount(row, hit, minlength=len(x))[row] > 0
+        values[to_neighbor] = np.where(hit, -1, 0)[to_neighbor]
+        return values
+
+    def _refresh(self):
+        super()._refresh()
+        self.sparse = isinstance(self.Qtable, SparseTable)
+        self.dtype = self.Qtable.data.dtype.type
+        if self.sparse:
+            self.Qtable.init, self.Qtable.touch = self._init_rows, self._touch_batch
+        self._best = self.Qtable.row_cache(int)
+        self._best_Q = self.Qtable.row_cache(self.dtype)
+        self._touch_all()
+
+    def _touch_all(self, chunk=1 << 16):
+        " update the greedy cache of all rows (materialized), `chunk` rows at a time to bound the temporaries "
+        x, d = self.Qtable.row_keys()
+        for at in range(0, len(x), chunk):
+            self._touch_batch(x[at:at + chunk], d[at:at + chunk])
+
+    def _touch(self, x, d):
+        " update the greedy cache of row Qtable[x][d] "
+        scores = self.Qtable[x][d]
+        self._best[x, d] = best = np.argmax(scores)
+        self._best_Q[x, d] = scores[best]
+
+    def _touch_batch(self, x, d):
+        " update the greedy cache of rows Qtable[x[i]][d[i]] for all i "
+        self._best[x, d], self._best_Q[x, d] = self.Qtable.row_argmax(x, d)
 
     def choose(self, source, dest, idx=False):
-        scores = self.Qtable[source][dest]
         if idx: # only for agent updating
-            return np.argmax(scores), scores.max()
+            return self._best[source, dest], self._best_Q[source, dest]
         else:
-            return self.links[source][np.argmax(scores)]
+            return self.links[source][self._best[source, dest]]
+
+    def choose_many(self, source, dests):
+        return self.links[source][self._best[source, dests]]
 
     def get_info(self, source, action, packet):
-        return {'max_Q_y': self.Qtable[action][packet.dest].max()}
+        return {'max_Q_y': self._best_Q[action, packet.dest]}
+
+    def get_info_batch(self, rewards):
+        return {'max_Q_y': self._best_Q[rewards.column('action'), rewards.column('dest')]}
 
     def _extract(self, reward):
         " s -> ... -> w -> x -> y -> z -> ... -> d"
@@ -39,33 +128,114 @@ class Qroute(Policy):
 
     def _update_qtable(self, r, x, y, d, max_Q_y, lr):
         y_idx = self.action_idx[x][y]
-        old_score = self.Qtable[x][d][y_idx]
-        self.Qtable[x][d][y_idx] += lr * \
-            (r + self.discount * max_Q_y - old_score)
+        # in Python floats: scalar arithmetic on NumPy float32 values is several times slower
+        row = self.Qtable[x][d]
+        old_score = float(row[y_idx])
+        row[y_idx] = old_score + lr * \
+            (r + self.discount * float(max_Q_y) - old_score)
+        self._touch(x, d)
 
     def _update(self, reward, lr={'q': 0.1}):
         " update agent once/one turn "
         r, info, x, y, d = self._extract(reward)
         self._update_qtable(r, x, y, d, info['max_Q_y'], lr['q'])
 
+    def _extract_batch(self, rewards, keys):
+        """ the columns of `rewards`, a RewardBatch or a list of Rewards
+
+        Returns:
+            r, x, y, d (np.array): rewards, sources, actions and destinations.
+            info (Dict[str, np.array]): the `agent_info` entries in `keys`.
+        """
+        rewards = RewardBatch.from_rewards(rewards)
+        r = -rewards.column('q_y') - rewards.column('t_y')
+        info = {k: rewards.column(k) for k in keys}
+        return r, rewards.column('source'), rewards.column('action'), rewards.column('dest'), info
+
+    def _action_index(self, x, y):
+        " the index of neighbor y[i] in links[x[i]] for all i "
+        return np.array([self.action_idx[a][b] for a, b in zip(x, y)], dtype=int)
+
+    def _update_qtable_batch(self, r, x, y_idx, d, max_Q_y, lr):
+        old_score = self.Qtable.gather(x, d, y_idx)
+        self.Qtable.scatter_add(x, d, y_idx,
+                                lr * (r + self.discount * max_Q_y - old_score))
+        self._touch_batch(x, d)
+
+    def _apply_batch(self, r, x, y_idx, d, *columns):
+        " call `_update_qtable_batch` on rounds of distinct entries "
+        for at in _rounds(x, d, y_idx):
+            self._update_qtable_batch(r[at], x[at], y_idx[at], d[at],
+                                      *(c[at] for c in columns))
+
+    def _learn_batch(self, rewards, lr={'q': 0.1}):
+        r, x, y, d, info = self._extract_batch(rewards, ['max_Q_y'])
+        self._apply_batch(r, x, self._action_index(x, y), d,
+                          info['max_Q_y'], np.full(len(r), lr['q']))
+
     def learn(self, rewards, lr={}):
-        for reward in rewards:
-            self._update(reward, lr if lr else self._update.__defaults__[0])
+        lr = lr if lr else self._update.__defaults__[0]
+        if self.batch:
+            self._learn_batch(rewards, lr)
+        else:
+            for reward in rewards:
+                self._update(reward, lr)
 
 
 class CQ(Qroute):
-    attrs = Qroute.attrs | set(['decay', 'confidence'])
+    """
+    Attributes:
+        confidence (Table): the confidence values divided by `confidence_scale`,
+            so decaying all of them is one multiplication of the scale.
+            Read and write single values through `_conf`/`_set_conf`.
+        confidence_scale (float): the common factor of `confidence`.
+        confidence_base (float): what a confidence of 1 set by `clean` is stored as now,
+            the scales folded into `confidence` since, for the rows a SparseTable initializes later.
+    """
+    attrs = Qroute.attrs | set(['decay', 'confidence', 'confidence_scale', 'confidence_base'])
+    # fold `confidence_scale` into `confidence` before it gets this small
+    min_scale = 1e-100
 
-    def __init__(self, network, decay=0.9, initQ=0, discount=0.9):
-        super().__init__(network, initQ, discount=discount)
+    def __init__(self, network, decay=0.9, initQ=0, discount=0.9, batch=False, sparse=False, dtype=np.float64):
+        super().__init__(network, initQ, discount=discount, batch=batch, sparse=sparse, dtype=dtype)
         self.decay = decay
-        self.confidence = {x: np.zeros_like(table, dtype=np.float64)
-                            for x, table in self.Qtable.items()}
+        self._min_scale = scale_floor(dtype, self.min_scale)
+        if self.sparse:
+            self.confidence = SparseTable(self.links, dtype=dtype, init=self._init_confidence)
+        else:
+            self.confidence = self.Qtable.like(0.0)
         self.clean()
 
+    def _init_confidence(self, x, d):
+        " the rows confidence[x[i]][d[i]] of a SparseTable, as set by `clean` and decayed since "
+        row, y = self.confidence.entries(x)
+        return (y == d[row]) * self.confidence_base
+
+    def _refresh(self):
+        super()._refresh()
+        self._min_scale = scale_floor(self.confidence.data.dtype, self.min_scale)
+        if isinstance(self.confidence, SparseTable):
+            self.confidence.init = self._init_confidence
+
+    def _conf(self, x, d, y_idx):
+        " confidence of choosing the `y_idx`-th neighbor at `x` to `d` "
+        return float(self.confidence[x][d][y_idx]) * self.confidence_scale
+
+    def _conf_batch(self, x, d, y_idx):
+        " `_conf` of all (x[i], d[i], y_idx[i]) "
+        return self.confidence.gather(x, d, y_idx) * self.confidence_scale
+
+    def _set_conf(self, x, d, y_idx, value):
+        self.confidence[x][d][y_idx] = value / self.confidence_scale
+
     def clean(self):
+        self.confidence_scale = 1.0
+        self.confidence_base = 1.0
+        if self.sparse:
+            self.confidence.clear()  # rows are initialized again when used
+            return
+        self.confidence.fill(0.0) # empty confidence
         for x, conf in self.confidence.items():
-            conf.fill(0.0) # empty confidence
             # the decision of sending to the destination is undoubtedly correct
             # base case: C_x(z, y) = 1 if z == y else 0
             conf[self.links[x]] = np.eye(conf.shape[1])
@@ -74,31 +244,68 @@ class CQ(Qroute):
         z_idx, max_Q_f = self.choose(action, packet.dest, idx=True)
         return {
             'max_Q_f': max_Q_f,
-            'C_f': self.confidence[action][packet.dest][z_idx]
+            'C_f': self._conf(action, packet.dest, z_idx)
+        }
+
+    def get_info_batch(self, rewards):
+        action, dest = rewards.column('action'), rewards.column('dest')
+        return {
+            'max_Q_f': self._best_Q[action, dest],
+            'C_f': self._conf_batch(action, dest, self._best[action, dest]),
         }
 
     def _update_qtable(self, r, x, y, d, C, max_Q):
         y_idx = self.action_idx[x][y]
-        old_Q = self.Qtable[x][d][y_idx]
-        old_conf = self.confidence[x][d][y_idx]
+        row = self.Qtable[x][d]
+        old_Q = float(row[y_idx])
+        old_conf = self._conf(x, d, y_idx)
+        C = float(C)
         eta = max(C, 1-old_conf)
-        self.Qtable[x][d][y_idx] += eta * \
-            (r + self.discount * max_Q - old_Q)
-        self.confidence[x][d][y_idx] += eta * (C-old_conf)
+        row[y_idx] = old_Q + eta * \
+            (r + self.discount * float(max_Q) - old_Q)
         # counteract the effect of confidence_decay()
-        self.confidence[x][d][y_idx] /= self.decay
+        self._set_conf(x, d, y_idx, (old_conf + eta * (C-old_conf)) / self.decay)
+        self._touch(x, d)
 
     def _update(self, reward, lr={}):
         r, info, x, y, d = self._extract(reward)
         self._update_qtable(r, x, y, d, info['C_f'], info['max_Q_f'])
 
+    def _update_qtable_batch(self, r, x, y_idx, d, C, max_Q):
+        old_Q = self.Qtable.gather(x, d, y_idx)
+        old_conf = self._conf_batch(x, d, y_idx)
+        eta = np.maximum(C, 1-old_conf)
+        self.Qtable.scatter_add(x, d, y_idx,
+                                eta * (r + self.discount * max_Q - old_Q))
+        self._touch_batch(x, d)
+        # counteract the effect of confidence_decay() as `_update_qtable` does
+        self.confidence.scatter(x, d, y_idx,
+                                (old_conf + eta * (C-old_conf)) / self.decay / self.confidence_scale)
+
+    def _learn_batch(self, rewards, lr={}):
+        r, x, y, d, info = self._extract_batch(rewards, ['C_f', 'max_Q_f'])
+        self._apply_batch(r, x, self._action_index(x, y), d,
+                          info['C_f'], info['max_Q_f'])
+
     def learn(self, rewards, lr={}):
         super().learn(rewards, lr)
         self.confidence_decay()
 
     def confidence_decay(self):
-        for table in self.confidence.values():
-            table *= self.decay
+        self.confidence_scale *= self.decay
+        if self.confidence_scale < self._min_scale:
+            self._fold_scale()
+
+    def _fold_scale(self):
+        " multiply `confidence_scale` into `confidence` "
+        self.confidence *= self.confidence_scale
+        self.confidence_base *= self.confidence_scale
+        self.confidence_scale = 1.0
+
+    def _state(self, dtype=None):
+        if dtype is not None:
+            self._fold_scale()  # so the stored values fit `dtype`
+        return super()._state(dtype)
 
 
 class CDRQ(CQ):
@@ -110,8 +317,18 @@ class CDRQ(CQ):
         return {
             'max_Q_b': max_Q_b,
             'max_Q_f': max_Q_f,
-            'C_b': self.confidence[source][packet.source][w_idx],
-            'C_f': self.confidence[action][packet.dest][z_idx],
+            'C_b': self._conf(source, packet.source, w_idx),
+            'C_f': self._conf(action, packet.dest, z_idx),
+        }
+
+    def get_info_batch(self, rewards):
+        source, action = rewards.column('source'), rewards.column('action')
+        src, dst = rewards.column('packet_source'), rewards.column('dest')
+        return {
+            'max_Q_b': self._best_Q[source, src],
+            'max_Q_f': self._best_Q[action, dst],
+            'C_b': self._conf_batch(source, src, self._best[source, src]),
+            'C_f': self._conf_batch(action, dst, self._best[action, dst]),
         }
 
     def _update(self, reward, lr={}):
@@ -121,6 +338,23 @@ class CDRQ(CQ):
         src = reward.packet.source
         self._update_qtable(r_b, y, x, src, info['C_b'], info['max_Q_b']) # backward
 
+    def _learn_batch(self, rewards, lr={}):
+        rewards = RewardBatch.from_rewards(rewards)
+        r_f, x, y, dst, info = self._extract_batch(
+            rewards, ['C_f', 'max_Q_f', 'C_b', 'max_Q_b', 'q_x', 't_x'])
+        r_b = -info['q_x'] - info['t_x']
+        src = rewards.column('packet_source')
+        # each forward update followed by its backward update, as `_update` does
+        def interleave(forward, backward):
+            return np.column_stack((forward, backward)).ravel()
+        self._apply_batch(
+            interleave(r_f, r_b),
+            interleave(x, y),
+            interleave(self._action_index(x, y), self._action_index(y, x)),
+            interleave(dst, src),
+            interleave(info['C_f'], info['C_b']),
+            interleave(info['max_Q_f'], info['max_Q_b']))
+
         
 class DRQ(Qroute):
     def get_info(self, source, action, packet):
@@ -131,6 +365,12 @@ class DRQ(Qroute):
             'max_Q_f': max_Q_f,
         }
 
+    def get_info_batch(self, rewards):
+        return {
+            'max_Q_b': self._best_Q[rewards.column('source'), rewards.column('packet_source')],
+            'max_Q_f': self._best_Q[rewards.column('action'), rewards.column('dest')],
+        }
+
     def _update(self, reward, lr={}):
         r_f, info, x, y, dst = self._extract(reward)
         self._update_qtable(r_f, x, y, dst, info['C_f'], info['max_Q_f']) # forward
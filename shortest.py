@@ -1,94 +1,139 @@
 import numpy as np
+from collections import deque
+from heapq import heappush, heappop
 
 from base_policy import Policy
 
 
+def bfs(neighbors, dest, unit):
+    """ distances from all nodes to `dest` when all nodes have the same `unit`
+
+    Args:
+        neighbors (List[List[int]]): the neighbors of each node.
+        unit (List[float]): the distance of stepping into each node.
+    """
+    distance = [np.inf] * len(unit)
+    distance[dest] = 0
+    frontier = deque([dest])
+    while frontier:
+        y = frontier.popleft()
+        d = distance[y] + unit[y]
+        for x in neighbors[y]:
+            if distance[x] == np.inf:
+                distance[x] = d
+                frontier.append(x)
+    return distance
+
+
+def dijkstra(neighbors, dest, unit):
+    " distances from all nodes to `dest`, as `bfs` with any `unit` "
+    distance = [np.inf] * len(unit)
+    distance[dest] = 0
+    heap = [(0, dest)]
+    push, pop = heappush, heappop
+    while heap:
+        d_y, y = pop(heap)
+        if d_y > distance[y]:
+            continue
+        d = d_y + unit[y]
+        for x in neighbors[y]:
+            if d < distance[x]:
+                distance[x] = d
+                push(heap, (d, x))
+    return distance
+
+
+def hop_distance(links):
+    """ the numbers of hops between all nodes of the graph `links` (as `Policy.links`), inf if disconnected
+
+    Returns:
+        np.array(float64, (nodes, nodes)): the hops from x to z at [x, z], as `Shortest.distance`.
+    """
+    neighbors = [list(links[x]) for x in range(len(links))]
+    unit = [1] * len(links)
+    return np.array([bfs(neighbors, z, unit) for z in range(len(links))]).T
+
+
 class Shortest(Policy):
-    """ Shortest agent determine the action based on Dijkstra algorithm. 
+    """ Shortest agent determines the action on the shortest paths,
+    found by BFS for unit distances and by Dijkstra algorithm otherwise.
 
     Parameters:
         multiway(bool): whether store ALL possible shortest paths or not.
         random(bool): only affect when `multiway=True`, choose the shortest path randomly from ALL shortest paths
 
     Attributes:
-        distance (np.array(float64, (nodes, nodes))): stores the distance between nodes
-        mask (np.array(bool, (nodes, nodes))): indicates `non-neighbors`, who are assumed infinity distance before dijkstra
-        choice (Dict[Int, np.array(bool, (nodes, neighbors))]): choice[a][b, :] indicates Node a to Node b which (multiple) neighbor(s) can be chosen
+        distance (np.array(float64, (nodes, nodes))): stores the distance between nodes,
+            the sum of `_unit()` of nodes on the path except the beginning one.
+        choice (Dict[Int, np.array(bool, (nodes, neighbors))]): choice[a][b, :] indicates Node a to Node b which (multiple) neighbor(s) can be chosen,
+            the first one of them in `links` if not `multiway`.
     """
-    attrs = Policy.attrs | set(['distance', 'choice', 'mask'])
+    attrs = Policy.attrs | set(['distance', 'choice'])
 
     def __init__(self, network, multiway=False, random=False):
         super().__init__(network)
         self.multiway = multiway
         self.random = random
+        self._neighbors = [self.links[x].tolist() for x in range(len(self.links))]
+        # all directed links (x, y) ordered by x, links of x are in [_link_start[x], _link_start[x+1])
+        self._link_from = np.repeat(np.arange(len(self.links)),
+                                    [len(self.links[x]) for x in range(len(self.links))])
+        self._link_to = np.concatenate([self.links[x] for x in range(len(self.links))])
+        self._link_start = np.searchsorted(self._link_from, np.arange(len(self.links) + 1))
         self.distance = np.full((len(self.links), len(self.links)), np.inf)
-        self.mask = np.ones_like(self.distance, dtype=np.bool)
-        self.choice = {n: np.zeros((len(self.links), len(v)), dtype=np.bool)
+        self.choice = {n: np.zeros((len(self.links), len(v)), dtype=bool)
                        for n, v in self.links.items()}
-        for x, neighbors in self.links.items():
-            self.distance[x, x] = 0
-            self.mask[x, x] = False
-            for y in neighbors:
-                self.distance[x, y] = 1
-                self.choice[x][y, self.action_idx[x][y]] = True
-                self.mask[x, y] = False
-        self.unit = lambda x: 1  # regard unit distance as 1
         self._calc_distance()
 
     def choose(self, source, dest):
         """ Return the action with shortest distance and the distance """
         choices = self.links[source][self.choice[source][dest]]
-        return np.random.choice(choices) if self.random else choices[0]
-
-    def _calc_distance(self):
-        self.distance[self.mask] = np.inf
-        changing = True
-        while changing:
-            changing = False
-            for x, neighbors in self.links.items():
-                for y in neighbors:
-                    for z in self.links.keys():
-                        new_dis = self.distance[y, z] + self.unit(y)
-                        if self.distance[x, z] > new_dis:
-                            self.distance[x, z] = new_dis
-                            self.choice[x][z, :].fill(False)
-                            self.choice[x][z, self.action_idx[x][y]] = True
-                            changing = True
-                        if self.multiway and np.isfinite(new_dis) and self.distance[x, z] == new_dis:
-                            self.choice[x][z, self.action_idx[x][y]] = True
-
-    def _calc_distance2(self):
-        """ I don't know why this function did not work. 
-        It SHOULD be same as (even faster than) the previous one.
-        """
-        self.distance[self.mask] = np.inf
-        changing = True
-        while changing:
-            changing = False
-            for x, neighbors in self.links.items():
-                for y in neighbors:
-                    new_dis = self.distance[y] + self.unit(y)
-                    greater = self.distance[x] > new_dis
-                    if greater.any():
-                        self.distance[x][greater] = new_dis[greater]
-                        self.choice[x][greater, :].fill(False)
-                        self.choice[x][greater, self.action_idx[x][y]] = True
-                        changing = True
-                    if self.multiway:
-                        equal = (np.isfinite(new_dis)) & (
-                            self.distance[x] == new_dis)
-                        if equal.any():
-                            self.choice[x][equal, self.action_idx[x][y]] = True
+        return self.rng.choice(choices) if self.random else choices[0]
+
+    def _unit(self):
+        " the distance of stepping into each node "
+        return np.ones(len(self.links))
+
+    def _calc_distance(self, dests=None):
+        """ compute `distance[:, z]` and `choice[x][z]` of all x for each z in `dests` (all nodes by default) """
+        unit = self._unit()
+        self._computed_unit = unit.copy()
+        dests = np.arange(len(self.links)) if dests is None else dests
+        if len(dests) == 0:
+            return
+        search = bfs if (unit == unit[0]).all() else dijkstra
+        for z in dests:
+            self.distance[:, z] = search(self._neighbors, z, unit.tolist())
+        self._calc_choice(dests, unit)
+
+    def _calc_choice(self, dests, unit):
+        " mark the neighbors on shortest paths to `dests` "
+        # via[l, z]: the distance from x to dests[z] through link l = (x, y)
+        via = self.distance[np.ix_(self._link_to, dests)] + unit[self._link_to, None]
+        best = np.isfinite(via) & (via == self.distance[np.ix_(self._link_from, dests)])
+        if not self.multiway:  # keep the first best link of each node
+            count = np.cumsum(best, axis=0)
+            before = np.vstack([np.zeros((1, len(dests)), dtype=count.dtype),
+                                count[self._link_start[1:-1] - 1]])
+            best &= count - np.repeat(before, np.diff(self._link_start), axis=0) == 1
+        for x, choice in self.choice.items():
+            choice[dests] = best[self._link_start[x]:self._link_start[x+1]].T
 
 
 class GlobalRoute(Shortest):
-    def __init__(self, network, multiway=False, random=False):
+    """ GlobalRoute agent routes on the shortest paths weighted by the queue sizes of nodes.
+
+    Parameters:
+        threshold(float): `learn` recomputes the paths once the unit of some node drifts
+            by more than this ratio from the one used last time, 0 to follow every change.
+    """
+    def __init__(self, network, multiway=False, random=False, threshold=0.0):
+        self.queue_size = np.zeros(len(network.links), dtype=int)
+        self.threshold = threshold
         super().__init__(network, multiway=multiway, random=random)
-        self.mask.fill(True)
-        np.fill_diagonal(self.mask, False)
-        self.queue_size = np.zeros(len(self.links), dtype=np.int)
-        self.unit = lambda x: 1+self.queue_size[x]
-        self._calc_distance()
+
+    def _unit(self):
+        return 1 + self.queue_size
 
     def receive(self, source, dest):
         self.queue_size[source] += 1
@@ -96,9 +141,23 @@ class GlobalRoute(Shortest):
     def send(self, source, dest):
         self.queue_size[source] -= 1
 
+    def _affected(self, unit):
+        """ the destinations whose distances or choices may change since the last computation.
+
+        Node y's unit only counts on paths entering y, so a change of it matters to destination z
+        only if some neighbor x of y reaches z through y at the lower one of its old and new units.
+        """
+        old = self._computed_unit
+        affected = np.zeros(len(self.links), dtype=bool)
+        for y in np.flatnonzero(unit != old):
+            via_y = self.distance[y] + min(unit[y], old[y])
+            affected |= (via_y <= self.distance[self.links[y]]).any(axis=0)
+        return np.flatnonzero(affected)
+
     def learn(self, rewards, lr={}):
         # for i, node in self.nodes.items():
         #     self.queue_size[i] = len(node.queue)
-        for choice in self.choice.values():
-            choice.fill(False)
-        self._calc_distance()
+        unit = self._unit()
+        drift = np.abs(unit - self._computed_unit) / self._computed_unit
+        if (drift > self.threshold).any():
+            self._calc_distance(self._affected(unit))
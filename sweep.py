@@ -0,0 +1,78 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from env import Network
+
+
+class SweepResult:
+    """ SweepResult gathers the results of `Network.train` over loads and seeds.
+
+    Attributes:
+        loads (np.array): the loads swept.
+        seeds (List[int]): the seeds of runs at each load.
+        route_time, droprate, hop (np.array((loads, seeds, steps))):
+            `train`'s results of the run of each load and seed, those it returned.
+    """
+    keys = ('route_time', 'droprate', 'hop')
+
+    def __init__(self, loads, seeds, runs):
+        self.loads = np.asarray(loads)
+        self.seeds = list(seeds)
+        for k in self.keys:
+            if k not in runs[0]:
+                continue
+            self.__dict__[k] = np.array([[run[k] for run in runs[i * len(self.seeds):(i + 1) * len(self.seeds)]]
+                                         for i in range(len(self.loads))])
+
+    def __repr__(self):
+        return f"SweepResult<{len(self.loads)} loads x {len(self.seeds)} seeds x {self.route_time.shape[-1]} steps>"
+
+    def __getitem__(self, key):
+        return self.__dict__[key]
+
+    def mean(self, key='route_time'):
+        " the average over seeds, (loads, steps) "
+        return self[key].mean(axis=1)
+
+    def final(self, key='route_time'):
+        " the average over seeds at the end of runs, one per load "
+        return self[key][:, :, -1].mean(axis=1)
+
+
+def _run(file, policy, policy_kwargs, load, seed, duration, train_kwargs):
+    nw = Network(file, seed=seed)
+    nw.agent = policy(nw, **policy_kwargs)
+    return nw.train(duration, load, **{'droprate': True, 'hop': True, **train_kwargs})
+
+
+def sweep(file, policy, loads, seeds=(0,), duration=1000, policy_kwargs={}, train_kwargs={}, workers=None):
+    """ sweep trains a new `policy` agent on the network in `file` for every load and seed,
+    running the simulations in `workers` processes.
+
+    The run of a seed is the same whichever process it runs in (see `Network.spawn_rng`),
+    and every load sees the same seeds.
+
+    Args:
+        file (str): the network file.
+        policy (type): the Policy class, built as `policy(network, **policy_kwargs)`.
+        loads (List[float]): the `lambd` of runs.
+        seeds (List[int]): the seeds of runs at each load.
+        duration (int): the duration of every run.
+        train_kwargs (Dict): more arguments to `Network.train`, like `lr`; `droprate` and `hop` are on by default.
+        workers (int): the number of processes, all CPUs by default; 1 runs in this process.
+
+    Returns:
+        SweepResult
+    """
+    tasks = [(load, seed) for load in loads for seed in seeds]
+    args = ([file] * len(tasks), [policy] * len(tasks), [policy_kwargs] * len(tasks),
+            [load for load, _ in tasks], [seed for _, seed in tasks],
+            [duration] * len(tasks), [train_kwargs] * len(tasks))
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    if workers <= 1:
+        runs = list(map(_run, *args))
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            runs = list(executor.map(_run, *args))
+    return SweepResult(loads, seeds, runs)
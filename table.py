@@ -0,0 +1,530 @@
+import sys
+import numpy as np
+
+
+def scale_floor(dtype, floor=1e-100):
+    """ how small the common factor of values stored divided by it may get (see SparseTrace):
+    `floor`, unless dividing by it could overflow `dtype` """
+    return max(floor, 1e4 / np.finfo(dtype).max)
+
+
+class Table:
+    """ Table stores one row per (node, destination) pair, with one entry per neighbor of the node,
+    in a single flat buffer (CSR-style: node `x` owns `data[offsets[x]:offsets[x+1]]`).
+
+    `table[x]` is a (nodes, neighbors) view of node `x`'s part, so a Table indexes like
+    a `{node: np.array((nodes, neighbors))}` dictionary, while whole-table operations
+    are one call on `data`.
+
+    Args:
+        links (Dict[Int, np.array(Int)]): the network graph, as `Policy.links`.
+        fill (float): the initial value of all entries.
+        dtype: the type of entries.
+        data (np.array): [optional] a flat buffer to use instead, e.g. shared or memory-mapped.
+
+    Attributes:
+        degree (np.array(Int)): the number of neighbors of each node.
+        offsets (np.array(Int)): where the part of each node begins in `data`.
+        data (np.array): the flat buffer.
+    """
+    def __init__(self, links, fill=0.0, dtype=np.float64, data=None):
+        self.links = links
+        self.degree = np.array([len(links[x]) for x in range(len(links))], dtype=int)
+        self.offsets = np.zeros(len(links) + 1, dtype=int)
+        np.cumsum(self.degree * len(links), out=self.offsets[1:])
+        if data is None:
+            data = np.full(self.offsets[-1], fill, dtype=dtype)
+        elif data.shape != (self.offsets[-1],):
+            raise ValueError(f"Table needs a flat buffer of {self.offsets[-1]} entries, got {data.shape}")
+        self.data = data
+        self._build_views()
+
+    @classmethod
+    def from_dict(cls, links, tables, dtype=np.float64):
+        " build a Table from a `{node: np.array((nodes, neighbors))}` dictionary "
+        table = cls(links, dtype=dtype)
+        for x, t in tables.items():
+            table[x] = t
+        return table
+
+    def _build_views(self):
+        n = len(self.links)
+        # the neighbors of all nodes, node after node
+        self._link_to = np.concatenate([self.links[x] for x in range(n)]).astype(int)
+        self._link_start = np.zeros(n + 1, dtype=int)
+        np.cumsum(self.degree, out=self._link_start[1:])
+        self._views = [self.data[self.offsets[x]:self.offsets[x+1]].reshape(n, self.degree[x])
+                       for x in range(n)]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_views']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._build_views()
+
+    def __repr__(self):
+        return f"Table<{len(self)} nodes, {self.data.size} entries of {self.data.dtype}>"
+
+    def __len__(self):
+        return len(self._views)
+
+    def __iter__(self):
+        return iter(range(len(self._views)))
+
+    def __getitem__(self, x):
+        return self._views[x]
+
+    def __setitem__(self, x, value):
+        self._views[x][...] = value
+
+    def keys(self):
+        return range(len(self._views))
+
+    def values(self):
+        return iter(self._views)
+
+    def items(self):
+        return enumerate(self._views)
+
+    def __imul__(self, other):
+        self.data *= getattr(other, 'data', other)
+        return self
+
+    def __iadd__(self, other):
+        self.data += getattr(other, 'data', other)
+        return self
+
+    def fill(self, value):
+        self.data.fill(value)
+
+    def copy(self):
+        return Table(self.links, data=self.data.copy())
+
+    def astype(self, dtype):
+        " a copy with entries of `dtype` "
+        return Table(self.links, data=self.data.astype(dtype))
+
+    def like(self, fill=0.0, dtype=None):
+        " a new Table of the same graph "
+        return Table(self.links, fill, dtype=self.data.dtype if dtype is None else dtype)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def row_keys(self):
+        """ the rows of the table, in order of `data`
+
+        Returns:
+            x, d (np.array(Int)): the row table[x[i]][d[i]] for all i.
+        """
+        return np.divmod(np.arange(len(self) ** 2), len(self))
+
+    def row_cache(self, dtype, fill=0):
+        " a `(nodes, nodes)` array of one value per row, `cache[x, d]` being that of row (x, d) "
+        return np.full((len(self), len(self)), fill, dtype=dtype)
+
+    def _starts(self, x, d):
+        " the positions in `data` where rows table[x[i]][d[i]] begin "
+        return self.offsets[x] + d * self.degree[x]
+
+    def index(self, x, d, y_idx):
+        " the positions in `data` of entries table[x[i]][d[i], y_idx[i]] "
+        return self._starts(x, d) + y_idx
+
+    def row_index(self, x, d):
+        " the positions in `data` of all entries of rows table[x[i]][d[i]], row after row "
+        degree = self.degree[x]
+        ends = np.cumsum(degree)
+        return np.repeat(self._starts(x, d) - ends + degree, degree) + np.arange(ends[-1])
+
+    def entries(self, x):
+        """ the entries of rows of nodes `x`, row after row
+
+        Returns:
+            row (np.array(Int)): the row each entry is in, `i` for a row of `x[i]`.
+            y (np.array(Int)): the neighbor each entry is of.
+        """
+        degree = self.degree[x]
+        ends = np.cumsum(degree)
+        at = np.repeat(self._link_start[x] - ends + degree, degree) + np.arange(ends[-1] if len(x) else 0)
+        return np.repeat(np.arange(len(x)), degree), self._link_to[at]
+
+    def locate(self, index):
+        """ the entries at positions `index` in `data`
+
+        Returns:
+            x, d, y_idx (np.array(Int)): table[x[i]][d[i], y_idx[i]] is data[index[i]].
+        """
+        x = np.searchsorted(self.offsets, index, side='right') - 1
+        d, y_idx = np.divmod(index - self.offsets[x], self.degree[x])
+        return x, d, y_idx
+
+    def gather(self, x, d, y_idx):
+        " table[x[i]][d[i], y_idx[i]] for all i "
+        index = self.index(x, d, y_idx)  # before reading `data`, which a SparseTable may grow
+        return self.data[index]
+
+    def scatter(self, x, d, y_idx, values):
+        " table[x[i]][d[i], y_idx[i]] = values[i] for all i "
+        index = self.index(x, d, y_idx)
+        self.data[index] = values
+
+    def scatter_add(self, x, d, y_idx, values):
+        " table[x[i]][d[i], y_idx[i]] += values[i] for all i, duplicated entries accumulate "
+        index = self.index(x, d, y_idx)
+        np.add.at(self.data, index, values)
+
+    def rows(self, x, d, fill=np.nan):
+        """ rows table[x[i]][d[i]] for all i, padded with `fill` to the longest one
+
+        Returns:
+            np.array((len(x), max(degree[x])))
+        """
+        degree = self.degree[x]
+        columns = np.arange(degree.max() if len(x) else 0)
+        valid = columns < degree[:, None]
+        index = np.where(valid, self._starts(x, d)[:, None] + columns, 0)
+        return np.where(valid, self.data[index], fill)
+
+    def peek(self, x, d, fill=np.nan):
+        " `rows`, which a SparseTable reads without materializing rows "
+        return self.rows(x, d, fill)
+
+    def row_argmax(self, x, d):
+        """ the first maximum of rows table[x[i]][d[i]] for all i
+
+        Returns:
+            argmax (np.array(Int)), max (np.array)
+        """
+        values = self.rows(x, d, -np.inf)
+        argmax = values.argmax(axis=1)
+        return argmax, values[np.arange(len(x)), argmax]
+
+
+class SparseTable(Table):
+    """ SparseTable is a Table storing only the rows in use: the first time a row (x, d) is read or written,
+    it is materialized with the values `init` gives, at the end of `data`, which grows as needed.
+
+    It indexes like a Table, `table[x][d]` being a view of row (x, d) until `data` grows,
+    so the positions of entries in `data` stay valid, but rows are in order of materialization.
+
+    Args:
+        links, fill, dtype: as Table, `fill` is the value of new rows if no `init` is given.
+        init (Callable): [optional] init(x, d) returns the values of new rows (x[i], d[i]), row after row.
+        touch (Callable): [optional] touch(x, d) is called after rows (x[i], d[i]) are materialized.
+            Neither is pickled, the owner of the table sets them again.
+
+    Attributes:
+        data (np.array): the entries of materialized rows, row after row, then free space.
+        row_count (int): the number of materialized rows.
+        row_x, row_d, row_start (np.array(Int)): the node, destination and position in `data`
+            of each materialized row, valid up to `row_count`.
+    """
+    def __init__(self, links, fill=0.0, dtype=np.float64, init=None, touch=None):
+        self.links = links
+        self.degree = np.array([len(links[x]) for x in range(len(links))], dtype=int)
+        self.fill_value = fill
+        self.init = init
+        self.touch = touch
+        self.clear(dtype)
+        self._build_views()
+
+    def _build_views(self):
+        n = len(self.links)
+        self._link_to = np.concatenate([self.links[x] for x in range(n)]).astype(int)
+        self._link_start = np.zeros(n + 1, dtype=int)
+        np.cumsum(self.degree, out=self._link_start[1:])
+
+    def clear(self, dtype=None):
+        " drop all rows, which `init` materializes again when used "
+        self.data = np.zeros(0, dtype=self.data.dtype if dtype is None else dtype)
+        self.row_count = 0
+        self.row_x = np.zeros(0, dtype=int)
+        self.row_d = np.zeros(0, dtype=int)
+        self.row_start = np.zeros(1, dtype=int)
+        self._slot = {}  # x * nodes + d -> the index of row (x, d) in `row_*`
+        self.generation = getattr(self, 'generation', -1) + 1  # counts clearings, for RowCache
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['init'] = state['touch'] = None
+        # only the materialized rows: the free space after them is uninitialized
+        rows = self.row_count
+        state['data'] = self.data[:self.row_start[rows]]
+        state['row_x'], state['row_d'] = self.row_x[:rows], self.row_d[:rows]
+        state['row_start'] = self.row_start[:rows + 1]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # no free space (even if stored with some), so new rows go to new buffers,
+        # never to arrays mapped read-only from a checkpoint
+        rows = self.row_count
+        self.data = self.data[:self.row_start[rows]]
+        self.row_x, self.row_d, self.row_start = self.row_x[:rows], self.row_d[:rows], self.row_start[:rows + 1]
+
+    def __repr__(self):
+        return f"SparseTable<{len(self)} nodes, {self.row_count} of {len(self) ** 2} rows, " \
+            f"{self.row_start[self.row_count]} entries of {self.data.dtype}>"
+
+    def __len__(self):
+        return len(self.degree)
+
+    def __iter__(self):
+        return iter(range(len(self)))
+
+    def __getitem__(self, x):
+        return _SparseRows(self, x)
+
+    def __setitem__(self, x, value):
+        raise TypeError("SparseTable sets rows one by one, as table[x][d] = value")
+
+    def keys(self):
+        return range(len(self))
+
+    def values(self):
+        return (self[x] for x in range(len(self)))
+
+    def items(self):
+        return ((x, self[x]) for x in range(len(self)))
+
+    def fill(self, value):
+        " every entry, materialized or not, reads `value` "
+        self.data.fill(value)
+        self.fill_value = value
+        self.init = None
+
+    def copy(self):
+        table = SparseTable.__new__(SparseTable)
+        table.__setstate__({k: v.copy() if hasattr(v, 'copy') else v for k, v in self.__getstate__().items()})
+        return table
+
+    def like(self, fill=0.0, dtype=None):
+        return SparseTable(self.links, fill, dtype=self.data.dtype if dtype is None else dtype)
+
+    def astype(self, dtype):
+        table = self.copy()
+        table.data = table.data.astype(dtype)
+        return table
+
+    @property
+    def nbytes(self):
+        " the bytes held, counting the row dictionary approximately "
+        arrays = self.data.nbytes + self.row_x.nbytes + self.row_d.nbytes + self.row_start.nbytes
+        return arrays + sys.getsizeof(self._slot) + 2 * sys.getsizeof(len(self) ** 2) * len(self._slot)
+
+    def row_keys(self):
+        return self.row_x[:self.row_count], self.row_d[:self.row_count]
+
+    def row_cache(self, dtype, fill=0):
+        return RowCache(self, dtype, fill)
+
+    def slot(self, x, d):
+        """ the indexes of rows (x[i], d[i]) in `row_*`, materializing the rows not used before
+
+        Returns:
+            np.array(Int), or an int for a single row.
+        """
+        n = len(self.degree)
+        if isinstance(x, (int, np.integer)) and isinstance(d, (int, np.integer)):
+            key = int(x) * n + int(d)
+            slot = self._slot.get(key)
+            if slot is None:
+                self._materialize(np.array([key]))
+                slot = self._slot[key]
+            return slot
+        keys = (np.asarray(x) * n + np.asarray(d)).ravel()
+        get = self._slot.get
+        slots = np.fromiter((get(k, -1) for k in keys.tolist()), dtype=int, count=len(keys))
+        missing = slots < 0
+        if missing.any():
+            self._materialize(np.unique(keys[missing]))
+            get = self._slot.__getitem__
+            slots[missing] = [get(k) for k in keys[missing].tolist()]
+        return slots.reshape(np.broadcast(x, d).shape)
+
+    def _materialize(self, keys):
+        " append rows of (unique) `keys`, x * nodes + d "
+        x, d = np.divmod(keys, len(self))
+        degree = self.degree[x]
+        rows, used = self.row_count + len(keys), self.row_start[self.row_count]
+        if rows > len(self.row_x):
+            capacity = max(2 * len(self.row_x), rows, 64)
+            self.row_x = np.resize(self.row_x, capacity)
+            self.row_d = np.resize(self.row_d, capacity)
+            self.row_start = np.resize(self.row_start, capacity + 1)
+        if used + degree.sum() > len(self.data):
+            data = np.empty(max(2 * len(self.data), used + degree.sum(), 256), dtype=self.data.dtype)
+            data[:used] = self.data[:used]
+            self.data = data
+        self.row_x[self.row_count:rows] = x
+        self.row_d[self.row_count:rows] = d
+        self.row_start[self.row_count + 1:rows + 1] = used + np.cumsum(degree)
+        self.data[used:self.row_start[rows]] = self.fill_value if self.init is None else self.init(x, d)
+        self._slot.update(zip(keys.tolist(), range(self.row_count, rows)))
+        self.row_count = rows
+        if self.touch is not None:
+            self.touch(x, d)
+
+    def _starts(self, x, d):
+        slot = self.slot(x, d)  # before reading `row_start`, which it may grow
+        return self.row_start[slot]
+
+    def peek(self, x, d, fill=np.nan):
+        """ `rows` without materializing rows: those not used yet read the values `init` gives them now,
+        which are not stored (so are drawn again when the rows are used, if `init` draws them) """
+        n = len(self)
+        used = np.fromiter((k in self._slot for k in (x * n + d).tolist()), dtype=bool, count=len(x))
+        degree = self.degree[x]
+        values = np.full((len(x), degree.max() if len(x) else 0), fill, dtype=self.data.dtype)
+        if used.any():
+            rows = self.rows(x[used], d[used], fill)
+            values[used, :rows.shape[1]] = rows
+        new = ~used
+        if new.any():
+            block = values[new]
+            # row after row, as `init` gives them
+            block[np.arange(block.shape[1]) < degree[new][:, None]] = \
+                self.fill_value if self.init is None else self.init(x[new], d[new])
+            values[new] = block
+        return values
+
+    def locate(self, index):
+        slot = np.searchsorted(self.row_start[:self.row_count + 1], index, side='right') - 1
+        return self.row_x[slot], self.row_d[slot], index - self.row_start[slot]
+
+
+class _SparseRows:
+    " the rows of node `x` in a SparseTable, materialized when indexed by destination "
+    __slots__ = ('table', 'x')
+
+    def __init__(self, table, x):
+        self.table = table
+        self.x = x
+
+    def __getitem__(self, d):
+        table = self.table
+        slot = table.slot(self.x, d)
+        start = table.row_start[slot]
+        return table.data[start:start + table.degree[self.x]]
+
+    def __setitem__(self, d, value):
+        self[d][...] = value
+
+
+class RowCache:
+    """ RowCache is the `(nodes, nodes)` array of one value per row of a SparseTable,
+    holding the values of materialized rows only: `cache[x, d]` materializes row (x, d).
+
+    Args:
+        table (SparseTable): whose rows.
+        fill: the value of rows not set yet.
+    """
+    def __init__(self, table, dtype, fill=0):
+        self.table = table
+        self.fill_value = fill
+        self.values = np.full(0, fill, dtype=dtype)
+        self._generation = table.generation
+
+    def __repr__(self):
+        return f"RowCache<{self.table.row_count} rows of {self.values.dtype}>"
+
+    def _values(self):
+        " the values, grown to the rows of the table "
+        if self._generation != self.table.generation:
+            self.values.fill(self.fill_value)
+            self._generation = self.table.generation
+        if self.table.row_count > len(self.values):
+            values = np.full(max(2 * len(self.values), self.table.row_count), self.fill_value, dtype=self.values.dtype)
+            values[:len(self.values)] = self.values
+            self.values = values
+        return self.values
+
+    def __getitem__(self, key):
+        slot = self.table.slot(*key)
+        return self._values()[slot]
+
+    def __setitem__(self, key, value):
+        slot = self.table.slot(*key)
+        self._values()[slot] = value
+
+    def fill(self, value):
+        self.fill_value = value
+        self.values.fill(value)
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes
+
+
+class SparseTrace:
+    """ SparseTrace is an eligibility trace over the entries of a Table, kept only for the
+    entries recently added to.
+
+    Values are stored divided by a global `scale`, so decaying the whole trace is one
+    multiplication of the scale, and entries decayed below `epsilon` are dropped.
+
+    Args:
+        epsilon (float): the magnitude under which entries are dropped.
+        dtype: the type of values.
+
+    Attributes:
+        index (np.array(Int)): the sorted positions of active entries in the Table's data.
+        value (np.array): their values divided by `scale`.
+        scale (float): the common factor of `value`.
+    """
+    # fold `scale` into `value` before it gets this small
+    min_scale = 1e-100
+
+    def __init__(self, epsilon=1e-6, dtype=np.float64):
+        self.epsilon = epsilon
+        self.dtype = dtype
+        self.min_scale = scale_floor(dtype, SparseTrace.min_scale)
+        self.clear()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __repr__(self):
+        return f"SparseTrace<{len(self)} active entries>"
+
+    @property
+    def nbytes(self):
+        return self.index.nbytes + self.value.nbytes
+
+    def clear(self):
+        self.index = np.zeros(0, dtype=int)
+        self.value = np.zeros(0, dtype=self.dtype)
+        self.scale = 1.0
+
+    def decay(self, factor):
+        " multiply all entries by `factor` "
+        self.scale *= factor
+        if self.scale < self.min_scale:
+            self.value *= self.scale
+            self.scale = 1.0
+
+    def add(self, index, values):
+        " add `values` to the entries at positions `index`, duplicated positions accumulate "
+        index = np.concatenate([self.index, index])
+        order = np.argsort(index, kind='stable')
+        index = index[order]
+        starts = np.flatnonzero(np.r_[True, index[1:] != index[:-1]])
+        values = np.concatenate([self.value, values / self.scale])[order]
+        self.index, self.value = index[starts], np.add.reduceat(values, starts).astype(self.dtype, copy=False)
+
+    def apply(self, data, coef):
+        """ data += coef * trace, then drop the negligible entries
+
+        Returns:
+            np.array(Int): the positions of data changed.
+        """
+        changed = self.index
+        data[changed] += coef * self.scale * self.value
+        keep = np.abs(self.value) * self.scale >= self.epsilon
+        self.index, self.value = self.index[keep], self.value[keep]
+        return changed
@@ -0,0 +1,309 @@
+import numpy as np
+import logging
+from abc import ABC, abstractmethod
+
+# a trace file is this magic, the number of nodes and the number of slots, then TRACE_DTYPE records;
+# a slot count of 0 (a recording not closed) counts the slots up to the last record
+TRACE_MAGIC = b'QRTRACE1'
+TRACE_HEADER = np.dtype([('magic', 'S8'), ('nodes', '<u4'), ('slots', '<u4')])
+TRACE_DTYPE = np.dtype([('slot', '<u4'), ('source', '<u4'), ('dest', '<u4')])
+
+
+class Traffic(ABC):
+    """ Traffic draws the packets arriving at a Network: in each time slot a Poisson number of them,
+    whose (source, destination) pairs are drawn by `pairs` all at once.
+
+    Args:
+        network (Network): where packets arrive.
+        ramp (Tuple[List[float], List[float]]): [optional] (times, factors) scaling the arrival rate
+            over time, linearly interpolated between the times and constant outside them.
+
+    Attributes:
+        rng (np.random.Generator): the random stream of traffic, spawned by the network.
+    """
+    def __init__(self, network, ramp=None):
+        self.nodes = len(network.links)
+        self.ramp = ramp
+        self.rng = network.spawn_rng()
+
+    def __repr__(self):
+        return f"<{type(self).__name__} nodes:{self.nodes} ramp:{self.ramp}>"
+
+    def load(self, clock):
+        " the factor of the arrival rate at time `clock` (an array of times) "
+        clock = np.asarray(clock, dtype=np.float64)
+        if self.ramp is None:
+            return np.ones_like(clock)
+        return np.interp(clock, *self.ramp)
+
+    @abstractmethod
+    def pairs(self, count):
+        """ the sources and destinations of `count` packets
+
+        Returns:
+            sources, dests (np.array(Int))
+        """
+
+    def unread(self, count):
+        """ [optional] the last `count` slots `arrivals` returned are not used (their packets not injected),
+        so a trace does not record or replay them; random traffic just drops them.
+        A count of 0 tells the slots returned were all used. """
+        pass
+
+    def arrival(self, lambd, clock):
+        """ the packets arriving in the slot beginning at `clock`
+
+        Returns:
+            sources, dests (np.array(Int))
+        """
+        return self.pairs(self.rng.poisson(lambd * self.load(clock)))
+
+    def arrivals(self, lambd, clocks):
+        """ the packets arriving in the slots beginning at `clocks`, drawn for all slots at once
+
+        Args:
+            lambd (int, float): the Poisson parameter, the average number of packets in a slot.
+            clocks (List[float]): when the slots begin.
+
+        Returns:
+            List[Tuple[np.array(Int), np.array(Int)]]: the sources and destinations of packets in each slot.
+        """
+        counts = self.rng.poisson(lambd * self.load(clocks))
+        sources, dests = self.pairs(counts.sum())
+        bounds = np.cumsum(counts)[:-1]
+        return list(zip(np.split(sources, bounds), np.split(dests, bounds)))
+
+
+class UniformTraffic(Traffic):
+    """ UniformTraffic sends packets between uniformly random pairs of distinct nodes. """
+    def pairs(self, count):
+        u = self.rng.random((2, count))
+        sources = (u[0] * self.nodes).astype(int)
+        # uniform over the other nodes, without rejecting dest == source
+        dests = (sources + 1 + (u[1] * (self.nodes - 1)).astype(int)) % self.nodes
+        return sources, dests
+
+
+class MatrixTraffic(Traffic):
+    """ MatrixTraffic sends packets between pairs of nodes in proportion to a traffic matrix.
+
+    Args:
+        matrix (np.array((nodes, nodes))): matrix[s, d] is the relative rate of packets from s to d,
+            the diagonal is ignored.
+    """
+    def __init__(self, network, matrix, ramp=None):
+        super().__init__(network, ramp=ramp)
+        matrix = np.array(matrix, dtype=np.float64)
+        if matrix.shape != (self.nodes, self.nodes) or (matrix < 0).any():
+            raise ValueError(f"a traffic matrix needs {self.nodes}x{self.nodes} non-negative rates")
+        np.fill_diagonal(matrix, 0)
+        self.matrix = matrix / matrix.sum()
+        self._cdf = np.cumsum(self.matrix.ravel())
+        self._cdf /= self._cdf[-1]
+
+    def pairs(self, count):
+        index = self._cdf.searchsorted(self.rng.random(count), side='right')
+        return np.divmod(index, self.nodes)
+
+
+class HotspotTraffic(MatrixTraffic):
+    """ HotspotTraffic sends a share of all packets to a few hotspot nodes, the rest uniformly.
+
+    Args:
+        hotspots (List[int]): the hotspot nodes.
+        ratio (float): the share of packets drawn for the hotspots, the rest drawn uniformly
+            (to the hotspots as well).
+    """
+    def __init__(self, network, hotspots, ratio=0.5, ramp=None):
+        n = len(network.links)
+        uniform = np.ones((n, n))
+        np.fill_diagonal(uniform, 0)
+        hot = np.zeros((n, n))
+        hot[:, hotspots] = 1
+        np.fill_diagonal(hot, 0)
+        super().__init__(network, (1 - ratio) * uniform / uniform.sum() + ratio * hot / hot.sum(), ramp=ramp)
+        self.hotspots = hotspots
+        self.ratio = ratio
+
+
+class GravityTraffic(MatrixTraffic):
+    """ GravityTraffic follows the gravity model: the rate between two nodes is proportional to
+    the product of their masses over a power of their distance, measured in the coordinates
+    given by the network file.
+
+    Args:
+        mass (np.array(float)): [optional] the masses of nodes, their degrees by default.
+        exponent (float): the power of distance.
+    """
+    def __init__(self, network, mass=None, exponent=1.0, ramp=None):
+        if np.isnan(network.coords).any():
+            raise ValueError("the gravity model needs the coordinates of all nodes")
+        if mass is None:
+            mass = np.array([len(network.links[x]) for x in range(len(network.links))], dtype=np.float64)
+        distance = np.linalg.norm(network.coords[:, None] - network.coords[None, :], axis=-1)
+        # coincident nodes as close as the closest ones apart, the diagonal is dropped anyway
+        positive = distance[distance > 0]
+        distance[distance == 0] = positive.min() if positive.size else 1
+        super().__init__(network, np.outer(mass, mass) / distance ** exponent, ramp=ramp)
+        self.exponent = exponent
+
+
+def read_trace(file):
+    """ the packets recorded in the trace `file`, memory-mapped
+
+    Returns:
+        nodes (int): the number of nodes in the recorded network.
+        trace (np.memmap(TRACE_DTYPE)): the records in order of slots.
+        slots (int): the number of slots recorded, empty ones at the end included.
+    """
+    header = np.fromfile(file, dtype=TRACE_HEADER, count=1)
+    if len(header) == 0 or header['magic'][0] != TRACE_MAGIC:
+        raise ValueError(f"{file} is not a traffic trace")
+    trace = np.memmap(file, dtype=TRACE_DTYPE, mode='r', offset=TRACE_HEADER.itemsize)
+    slots = int(header['slots'][0])
+    if slots == 0 and len(trace) > 0:
+        slots = int(trace['slot'][-1]) + 1
+    return int(header['nodes'][0]), trace, slots
+
+
+class TraceRecorder(Traffic):
+    """ TraceRecorder draws packets from another Traffic and records them to a trace file,
+    which TraceTraffic replays: (slot, source, dest) records of 12 bytes after a 16-byte header.
+
+    The slots of the last `arrivals` are written when more are drawn or on `close`, less those `unread`,
+    so the trace holds the slots used.
+
+    Call `close` (or use it as a context manager) when done.
+
+    Args:
+        traffic (Traffic): what draws the packets.
+        file (str): the trace file, overwritten.
+    """
+    def __init__(self, traffic, file):
+        self.traffic = traffic
+        self.nodes = traffic.nodes
+        self.ramp = traffic.ramp
+        self.rng = traffic.rng
+        self.file = file
+        self._slot = 0  # the number of slots recorded
+        self._pending = []  # the slots of the last `arrivals`, not written yet
+        self._f = open(file, 'wb')
+        self._write_header()
+
+    def _write_header(self):
+        self._f.seek(0)
+        np.array([(TRACE_MAGIC, self.nodes, self._slot)], dtype=TRACE_HEADER).tofile(self._f)
+        self._f.seek(0, 2)
+
+    def __repr__(self):
+        return f"<TraceRecorder {self.file} of {self.traffic}, {self._slot} slots>"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._record(self._pending)
+        self._pending = []
+        self._write_header()
+        self._f.close()
+
+    def _record(self, slots):
+        counts = [len(sources) for sources, _ in slots]
+        records = np.empty(sum(counts), dtype=TRACE_DTYPE)
+        records['slot'] = np.repeat(np.arange(self._slot, self._slot + len(slots)), counts)
+        if len(records) > 0:
+            records['source'] = np.concatenate([sources for sources, _ in slots])
+            records['dest'] = np.concatenate([dests for _, dests in slots])
+        records.tofile(self._f)
+        self._slot += len(slots)
+        return slots
+
+    def load(self, clock):
+        return self.traffic.load(clock)
+
+    def pairs(self, count):
+        return self.traffic.pairs(count)
+
+    def arrival(self, lambd, clock):
+        self._record(self._pending)
+        self._pending = []
+        return self._record([self.traffic.arrival(lambd, clock)])[0]
+
+    def arrivals(self, lambd, clocks):
+        self._record(self._pending)
+        self._pending = self.traffic.arrivals(lambd, clocks)
+        return self._pending
+
+    def unread(self, count):
+        self._pending = self._pending[:len(self._pending) - count]
+        self.traffic.unread(count)
+
+
+class TraceTraffic(Traffic):
+    """ TraceTraffic replays the packets recorded by TraceRecorder slot by slot,
+    reading them from the memory-mapped file without drawing any random number.
+
+    The recorded load is replayed whatever `lambd` is asked for;
+    slots past the end of the trace have no packets, with a warning once they are taken.
+
+    Args:
+        file (str): the trace file.
+    """
+    def __init__(self, network, file):
+        nodes, self.trace, slots = read_trace(file)
+        if nodes != len(network.links):
+            raise ValueError(f"{file} records a network of {nodes} nodes, not {len(network.links)}")
+        super().__init__(network)
+        self.file = file
+        # the records of slot i are trace[_bounds[i]:_bounds[i+1]]
+        self._bounds = np.searchsorted(self.trace['slot'], np.arange(slots + 1))
+        self._slot = 0  # the next slot to replay
+        self._warned = False
+
+    def __repr__(self):
+        return f"<TraceTraffic {self.file}, slot {self._slot} of {len(self)}>"
+
+    def __len__(self):
+        " the number of slots in the trace "
+        return len(self._bounds) - 1
+
+    def rewind(self):
+        " replay from the first slot again "
+        self._slot = 0
+        self._warned = False
+
+    def _check_end(self):
+        " warn once the slots replayed so far, all taken, run past the end of the trace "
+        if self._slot > len(self) and not self._warned:
+            logging.warning(f"{self.file} ends at slot {len(self)}, no more packets")
+            self._warned = True
+
+    def _replay(self, start, end):
+        " the packets of slots [start, end), read from the trace at once "
+        stop = max(start, min(end, len(self)))  # slots [start, stop) are in the trace
+        bounds = self._bounds[start:stop + 1] if stop > start else self._bounds[:1]
+        # the (slot, source, dest) records as columns of a plain array, still memory-mapped
+        records = np.asarray(self.trace).view('<u4').reshape(-1, 3)[bounds[0]:bounds[-1]]
+        cuts = bounds[1:-1] - bounds[0]
+        slots = list(zip(np.split(records[:, 1], cuts), np.split(records[:, 2], cuts)))
+        return slots[:stop - start] + [(records[:0, 1], records[:0, 2])] * (end - stop)
+
+    def pairs(self, count):
+        raise TypeError("TraceTraffic replays whole slots, it draws no pairs")
+
+    def arrival(self, lambd, clock):
+        return self.arrivals(lambd, [clock])[0]
+
+    def arrivals(self, lambd, clocks):
+        # the slots of the last call were all taken, as none were handed back
+        self._check_end()
+        start, self._slot = self._slot, self._slot + len(clocks)
+        return self._replay(start, self._slot)
+
+    def unread(self, count):
+        """ replay the last `count` slots again """
+        self._slot -= count
+        self._check_end()